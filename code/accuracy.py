@@ -135,9 +135,9 @@ def plot_results(results, filepath, y_label, y_limits, y_unit):
 	axis.set_ylabel(y_label)
 	fig.tight_layout(pad=0.5, h_pad=1, w_pad=1)
 	fig.savefig(filepath, format='svg')
-	core.format_svg_labels(filepath, core.algorithms)
+	svg = core.format_svg_labels(filepath, core.algorithms)
 	if not filepath.endswith('.svg'):
-		core.convert_svg(filepath, filepath)
+		core.convert_svg(svg, filepath)
 
 def plot_proportion_above(axis, accuracy_results, target_accuracy=95):
 	prop_adults = []
@@ -173,9 +173,9 @@ def plot_proportions(accuracy_results, rater_ids, filepath):
 	axes[3].set_yticklabels([])
 	fig.tight_layout(pad=0.5, h_pad=1, w_pad=1)
 	fig.savefig(filepath, format='svg')
-	core.format_svg_labels(filepath, core.algorithms)
+	svg = core.format_svg_labels(filepath, core.algorithms)
 	if not filepath.endswith('.svg'):
-		core.convert_svg(filepath, filepath)
+		core.convert_svg(svg, filepath)
 
 def plot_acceptability_ratings(axis, rater_ids):
 	prop_acceptable = calculate_prop_acceptable(rater_ids)
@@ -6,22 +6,129 @@ contains versions of the algorithms that are adapted to our evaluation
 and visualization pipelines.
 '''
 
+from time import perf_counter
+import inspect
 import numpy as np
-from sklearn.cluster import KMeans
-from scipy.optimize import minimize
-from scipy.stats import norm
+import profiling
 
+# sklearn and scipy are slow to import, so they are only imported by the
+# algorithms that need them (cluster, split, regress, and stretch)
 
-def correct_drift(method, fixation_XY, passage, return_line_assignments=False, **params):
-	function = globals()[method]
+
+registry = {}
+
+def register(inputs, deterministic, complexity, cost, modes=('batch',)):
+	'''
+	Decorator that adds an algorithm to the registry along with metadata
+	describing it: the inputs it requires besides the fixations, whether
+	its output is deterministic, its time complexity (n fixations, m
+	lines, w words), a cost model (coefficient, exponent) in the number
+	of fixations for scheduling, or a function mapping the parameters to
+	a cost model, and the modes it supports (batch, online, or anytime,
+	i.e. accepts a time or evaluation budget). The default parameters are
+	read from the function signature, and 'cost' holds the cost model at
+	the defaults.
+	'''
+	def decorator(function):
+		parameters = inspect.signature(function).parameters
+		defaults = {name:parameter.default for name, parameter in parameters.items() if parameter.default is not inspect.Parameter.empty and name not in ('return_line_assignments', 'return_truncated')}
+		cost_model = cost if callable(cost) else lambda params: cost
+		registry[function.__name__] = {'function':function, 'inputs':inputs, 'deterministic':deterministic, 'complexity':complexity, 'cost':cost_model(defaults), 'cost_model':cost_model, 'modes':modes, 'defaults':defaults}
+		return function
+	return decorator
+
+def estimated_cost(method, n_fixations, params=None):
+	algorithm = registry[method]
+	coefficient, exponent = algorithm['cost_model']({**algorithm['defaults'], **(params or {})})
+	return coefficient * n_fixations ** exponent
+
+
+def correct_drift(method, fixation_XY, passage, return_line_assignments=False, return_truncated=False, **params):
+	'''
+	Run a method on a trial. If return_truncated is set, returns the
+	output along with a flag indicating whether an anytime method ran out
+	of its time or evaluation budget (always False for other methods).
+	'''
+	algorithm = registry[method]
+	if return_truncated:
+		if 'anytime' in algorithm['modes']:
+			params['return_truncated'] = True
+		else:
+			return correct_drift(method, fixation_XY, passage, return_line_assignments, **params), False
+	function = algorithm['function']
 	fixation_XY = np.array(fixation_XY, dtype=int)
 	line_positions = np.array(passage.midlines, dtype=int)
-	if method in ['compare', 'warp']:
+	args = [fixation_XY, line_positions]
+	if 'word_XY' in algorithm['inputs']:
 		word_centers = np.array(passage.word_centers(), dtype=int)
-		return function(fixation_XY, line_positions, word_centers, return_line_assignments=return_line_assignments, **params)
-	return function(fixation_XY, line_positions, return_line_assignments=return_line_assignments, **params)
+		args.append(word_centers)
+	if profiling.active is not None:
+		n_words = len(args[2]) if len(args) > 2 else len(list(passage.words()))
+		return profiling.active.measure(method, function, *args, n_words=n_words, return_line_assignments=return_line_assignments, **params)
+	return function(*args, return_line_assignments=return_line_assignments, **params)
+
+
+class Budget:
+
+	def __init__(self, time_budget=None, max_evaluations=None):
+		self.limited = time_budget is not None or max_evaluations is not None
+		self.deadline = None if time_budget is None else perf_counter() + time_budget
+		self.max_evaluations = max_evaluations
+		self.n_evaluations = 0
+		self.truncated = False
 
+	def spend(self):
+		'''
+		Counts one unit of work (a candidate merger or an objective
+		evaluation) and returns True once the evaluation limit or the
+		deadline has been exceeded.
+		'''
+		self.n_evaluations += 1
+		if self.max_evaluations is not None and self.n_evaluations > self.max_evaluations:
+			self.truncated = True
+		elif self.deadline is not None and perf_counter() > self.deadline:
+			self.truncated = True
+		return self.truncated
 
+	def report(self, output, return_truncated=False):
+		'''
+		Returns the output, along with a flag indicating whether the
+		search was cut short if return_truncated is set. Truncation is
+		also counted on the active profiler.
+		'''
+		if self.truncated:
+			profiling.count('truncated')
+		if return_truncated:
+			return output, self.truncated
+		return output
+
+
+class BudgetExhausted(Exception):
+	pass
+
+
+def minimize_within_budget(objective, x0, budget, **kwargs):
+	'''
+	Wrapper around scipy's minimize that stops as soon as the budget
+	runs out, returning the best parameters evaluated so far.
+	'''
+	from scipy.optimize import minimize
+	best_x, best_value = np.array(x0, dtype=float), np.inf
+	def budgeted_objective(params):
+		nonlocal best_x, best_value
+		if budget.spend():
+			raise BudgetExhausted
+		value = objective(params)
+		if value < best_value:
+			best_x, best_value = np.array(params, dtype=float), value
+		return value
+	try:
+		return minimize(budgeted_objective, x0, **kwargs).x
+	except BudgetExhausted:
+		return best_x
+
+
+@register(inputs=('line_Y',), deterministic=True, complexity='O(nm)', cost=(1, 1))
 def attach(fixation_XY, line_Y, return_line_assignments=False):
 	n = len(fixation_XY)
 	######################### FOR SIMULATIONS #########################
@@ -38,6 +145,7 @@ def attach(fixation_XY, line_Y, return_line_assignments=False):
 	return fixation_XY
 
 
+@register(inputs=('line_Y',), deterministic=True, complexity='O(n + m)', cost=(1, 1))
 def chain(fixation_XY, line_Y, x_thresh=192, y_thresh=32, return_line_assignments=False):
 	n = len(fixation_XY)
 	dist_X = abs(np.diff(fixation_XY[:, 0]))
@@ -63,10 +171,13 @@ def chain(fixation_XY, line_Y, x_thresh=192, y_thresh=32, return_line_assignment
 	return fixation_XY
 
 
+@register(inputs=('line_Y',), deterministic=False, complexity='O(nm) per KMeans iteration', cost=(1000, 1))
 def cluster(fixation_XY, line_Y, return_line_assignments=False):
+	from sklearn.cluster import KMeans
 	m = len(line_Y)
 	fixation_Y = fixation_XY[:, 1].reshape(-1, 1)
 	clusters = KMeans(m, n_init=100, max_iter=300).fit_predict(fixation_Y)
+	profiling.count('kmeans_fits')
 	centers = [fixation_Y[clusters == i].mean() for i in range(m)]
 	ordered_cluster_indices = np.argsort(centers)
 	######################### FOR SIMULATIONS #########################
@@ -83,6 +194,7 @@ def cluster(fixation_XY, line_Y, return_line_assignments=False):
 	return fixation_XY
 
 
+@register(inputs=('line_Y', 'word_XY'), deterministic=True, complexity='O(nw)', cost=(10, 1.5))
 def compare(fixation_XY, line_Y, word_XY, x_thresh=512, n_nearest_lines=3, return_line_assignments=False):
 	n = len(fixation_XY)
 	diff_X = np.diff(fixation_XY[:, 0])
@@ -122,13 +234,15 @@ phases = [{'min_i':3, 'min_j':3, 'no_constraints':False},
           {'min_i':1, 'min_j':1, 'no_constraints':False},
           {'min_i':1, 'min_j':1, 'no_constraints':True}]
 
-def merge(fixation_XY, line_Y, y_thresh=32, g_thresh=0.1, e_thresh=20, return_line_assignments=False):
+@register(inputs=('line_Y',), deterministic=True, complexity='O(n^3)', cost=(1, 3), modes=('batch', 'anytime'))
+def merge(fixation_XY, line_Y, y_thresh=32, g_thresh=0.1, e_thresh=20, time_budget=None, max_evaluations=None, return_truncated=False, return_line_assignments=False):
 	n = len(fixation_XY)
 	m = len(line_Y)
 	diff_X = np.diff(fixation_XY[:, 0])
 	dist_Y = abs(np.diff(fixation_XY[:, 1]))
 	sequence_boundaries = list(np.where(np.logical_or(diff_X < 0, dist_Y > y_thresh))[0] + 1)
 	sequences = [list(range(start, end)) for start, end in zip([0]+sequence_boundaries, sequence_boundaries+[n])]
+	budget = Budget(time_budget, max_evaluations)
 	for phase in phases:
 		while len(sequences) > m:
 			best_merger = None
@@ -139,6 +253,8 @@ def merge(fixation_XY, line_Y, y_thresh=32, g_thresh=0.1, e_thresh=20, return_li
 				for j in range(i+1, len(sequences)):
 					if len(sequences[j]) < phase['min_j']:
 						continue
+					if budget.spend():
+						break
 					candidate_XY = fixation_XY[sequences[i] + sequences[j]]
 					gradient, intercept = np.polyfit(candidate_XY[:, 0], candidate_XY[:, 1], 1)
 					residuals = candidate_XY[:, 1] - (gradient * candidate_XY[:, 0] + intercept)
@@ -147,12 +263,23 @@ def merge(fixation_XY, line_Y, y_thresh=32, g_thresh=0.1, e_thresh=20, return_li
 						if error < best_error:
 							best_merger = (i, j)
 							best_error = error
+				if budget.truncated:
+					break
+			# If the budget ran out during the search, the best merger among
+			# the candidates evaluated so far is still applied
 			if not best_merger:
 				break
 			merge_i, merge_j = best_merger
 			merged_sequence = sequences[merge_i] + sequences[merge_j]
 			sequences.append(merged_sequence)
 			del sequences[merge_j], sequences[merge_i]
+			if budget.truncated:
+				break
+		if budget.truncated:
+			break
+	profiling.count('merge_pairs', budget.n_evaluations)
+	if budget.truncated:
+		sequences = merge_nearest_sequences(fixation_XY, sequences, m)
 	mean_Y = [fixation_XY[sequence, 1].mean() for sequence in sequences]
 	ordered_sequence_indices = np.argsort(mean_Y)
 	######################### FOR SIMULATIONS #########################
@@ -160,14 +287,31 @@ def merge(fixation_XY, line_Y, y_thresh=32, g_thresh=0.1, e_thresh=20, return_li
 		line_assignments = []
 		for line_i, sequence_i in enumerate(ordered_sequence_indices):
 			line_assignments.extend( [line_i] * len(sequences[sequence_i]) )
-		return np.array(line_assignments, dtype=int)
+		return budget.report(np.array(line_assignments, dtype=int), return_truncated)
 	###################################################################
 	for line_i, sequence_i in enumerate(ordered_sequence_indices):
 		fixation_XY[sequences[sequence_i], 1] = line_Y[line_i]
-	return fixation_XY
+	return budget.report(fixation_XY, return_truncated)
 
+def merge_nearest_sequences(fixation_XY, sequences, m):
+	'''
+	Cheap completion of an interrupted merge: repeatedly merges the two
+	sequences whose mean y-values are closest until m sequences remain.
+	'''
+	while len(sequences) > m:
+		mean_Y = np.array([fixation_XY[sequence, 1].mean() for sequence in sequences])
+		ordered_sequence_indices = np.argsort(mean_Y)
+		k = np.argmin(np.diff(mean_Y[ordered_sequence_indices]))
+		merge_i, merge_j = sorted(ordered_sequence_indices[k:k+2])
+		merged_sequence = sequences[merge_i] + sequences[merge_j]
+		sequences.append(merged_sequence)
+		del sequences[merge_j], sequences[merge_i]
+	return sequences
 
-def regress(fixation_XY, line_Y, k_bounds=(-0.1, 0.1), o_bounds=(-50, 50), s_bounds=(1, 20), return_line_assignments=False):
+
+@register(inputs=('line_Y',), deterministic=True, complexity='O(nm) per evaluation', cost=(500, 1), modes=('batch', 'anytime'))
+def regress(fixation_XY, line_Y, k_bounds=(-0.1, 0.1), o_bounds=(-50, 50), s_bounds=(1, 20), time_budget=None, max_evaluations=None, prior=None, return_truncated=False, return_line_assignments=False):
+	from scipy.stats import norm
 	n = len(fixation_XY)
 	m = len(line_Y)
 
@@ -185,17 +329,29 @@ def regress(fixation_XY, line_Y, k_bounds=(-0.1, 0.1), o_bounds=(-50, 50), s_bou
 			return density.argmax(axis=1)
 		return -sum(density.max(axis=1))
 
-	best_fit = minimize(fit_lines, [0, 0, 0], method='powell')
-	line_assignments = fit_lines(best_fit.x, True)
+	# Start from the participant's previous fit (slope, offset, spread) if
+	# a drift prior is given, mapped back through the bounds
+	bounds = [k_bounds, o_bounds, s_bounds]
+	x0 = [0, 0, 0]
+	if prior is not None and prior.get('regress') is not None:
+		x0 = [norm.ppf(np.clip((value - low) / (high - low), 0.001, 0.999)) for value, (low, high) in zip(prior.get('regress'), bounds)]
+
+	budget = Budget(time_budget, max_evaluations)
+	best_params = minimize_within_budget(fit_lines, x0, budget, method='powell')
+	profiling.count('optimizer_evaluations', budget.n_evaluations)
+	if prior is not None and not budget.truncated:
+		prior.update('regress', [low + (high - low) * norm.cdf(param) for param, (low, high) in zip(best_params, bounds)])
+	line_assignments = fit_lines(best_params, True)
 	######################### FOR SIMULATIONS #########################
 	if return_line_assignments:
-		return line_assignments
+		return budget.report(line_assignments, return_truncated)
 	###################################################################
 	for fixation_i, line_i in enumerate(line_assignments):
 		fixation_XY[fixation_i, 1] = line_Y[line_i]
-	return fixation_XY
+	return budget.report(fixation_XY, return_truncated)
 
 
+@register(inputs=('line_Y',), deterministic=True, complexity='O(n log n)', cost=(1, 1))
 def segment(fixation_XY, line_Y, return_line_assignments=False):
 	n = len(fixation_XY)
 	m = len(line_Y)
@@ -219,10 +375,13 @@ def segment(fixation_XY, line_Y, return_line_assignments=False):
 	return fixation_XY
 
 
+@register(inputs=('line_Y',), deterministic=False, complexity='O(n) per KMeans iteration', cost=(100, 1))
 def split(fixation_XY, line_Y, return_line_assignments=False):
+	from sklearn.cluster import KMeans
 	n = len(fixation_XY)
 	diff_X = np.diff(fixation_XY[:, 0])
 	clusters = KMeans(2, n_init=10, max_iter=300).fit_predict(diff_X.reshape(-1, 1))
+	profiling.count('kmeans_fits')
 	centers = [diff_X[clusters == 0].mean(), diff_X[clusters == 1].mean()]
 	sweep_marker = np.argmin(centers)
 	end_line_indices = list(np.where(clusters == sweep_marker)[0] + 1)
@@ -246,7 +405,8 @@ def split(fixation_XY, line_Y, return_line_assignments=False):
 	return fixation_XY
 
 
-def stretch(fixation_XY, line_Y, scale_bounds=(0.9, 1.1), offset_bounds=(-50, 50), return_line_assignments=False):
+@register(inputs=('line_Y',), deterministic=True, complexity='O(nm) per evaluation', cost=(100, 1), modes=('batch', 'anytime'))
+def stretch(fixation_XY, line_Y, scale_bounds=(0.9, 1.1), offset_bounds=(-50, 50), time_budget=None, max_evaluations=None, prior=None, return_truncated=False, return_line_assignments=False):
 	n = len(fixation_XY)
 	fixation_Y = fixation_XY[:, 1]
 
@@ -260,19 +420,31 @@ def stretch(fixation_XY, line_Y, scale_bounds=(0.9, 1.1), offset_bounds=(-50, 50
 			return corrected_Y
 		return sum(abs(candidate_Y - corrected_Y))
 
-	best_fit = minimize(fit_lines, [1, 0], method='powell', bounds=[scale_bounds, offset_bounds])
+	# Start from the participant's previous fit (scale, offset) if a drift
+	# prior is given
+	bounds = [scale_bounds, offset_bounds]
+	x0 = [1, 0]
+	if prior is not None and prior.get('stretch') is not None:
+		x0 = [np.clip(value, low, high) for value, (low, high) in zip(prior.get('stretch'), bounds)]
+
+	budget = Budget(time_budget, max_evaluations)
+	best_params = minimize_within_budget(fit_lines, x0, budget, method='powell', bounds=bounds)
+	profiling.count('optimizer_evaluations', budget.n_evaluations)
+	if prior is not None and not budget.truncated:
+		prior.update('stretch', list(best_params))
 	######################### FOR SIMULATIONS #########################
 	if return_line_assignments:
-		candidate_Y = fixation_Y * best_fit.x[0] + best_fit.x[1]
+		candidate_Y = fixation_Y * best_params[0] + best_params[1]
 		corrected_I = np.zeros(n, dtype=int)
 		for fixation_i in range(n):
 			corrected_I[fixation_i] = np.argmin(abs(line_Y - candidate_Y[fixation_i]))
-		return corrected_I
+		return budget.report(corrected_I, return_truncated)
 	###################################################################
-	fixation_XY[:, 1] = fit_lines(best_fit.x, return_correction=True)
-	return fixation_XY
+	fixation_XY[:, 1] = fit_lines(best_params, return_correction=True)
+	return budget.report(fixation_XY, return_truncated)
 
 
+@register(inputs=('line_Y', 'word_XY'), deterministic=True, complexity='O(nw)', cost=(10, 2))
 def warp(fixation_XY, line_Y, word_XY, return_line_assignments=False):
 	_, warping_path = dynamic_time_warping(fixation_XY, word_XY)
 	######################### FOR SIMULATIONS #########################
@@ -295,9 +467,66 @@ def mode(values):
 	return max(set(values), key=values.count)
 
 
+class OnlineWarp:
+
+	def __init__(self, line_Y, word_XY, band=None):
+		self.line_Y = list(line_Y)
+		self.word_XY = np.array(word_XY, dtype=int)
+		self.band = band
+		# The frontier row of the DTW cost matrix is stored as the cells
+		# from column frontier_start onwards; all other cells are infinite
+		self.frontier = np.zeros(1)
+		self.frontier_start = 0
+		self.best_word_i = 0
+
+	def advance(self, fixation_xy):
+		'''
+		Extends the open-end alignment by one fixation and returns the
+		provisional line assignment for that fixation. Only the frontier
+		row of the DTW cost matrix is kept; if a band is set, only the
+		words within that many positions of the previous best word are
+		updated, so each step takes O(band) time and space.
+		'''
+		n_words = len(self.word_XY)
+		if self.band is None:
+			start, end = 0, n_words
+		else:
+			start = max(0, self.best_word_i - self.band)
+			end = min(n_words, self.best_word_i + self.band + 1)
+		costs = np.sqrt(((self.word_XY[start:end] - fixation_xy)**2).sum(axis=1))
+		profiling.count('dtw_cells', end - start)
+		# Previous frontier in columns start to end (word start-1 to word
+		# end-1), giving the up and diagonal predecessors of each cell
+		previous = np.full(end - start + 1, np.inf)
+		overlap_start = max(start, self.frontier_start)
+		overlap_end = min(end + 1, self.frontier_start + len(self.frontier))
+		if overlap_start < overlap_end:
+			previous[overlap_start-start:overlap_end-start] = self.frontier[overlap_start-self.frontier_start:overlap_end-self.frontier_start]
+		# frontier[j] = costs[j] + min(previous[j+1], previous[j], frontier[j-1])
+		# is solved for the whole band with a cumulative sum and minimum
+		cumulative_costs = np.cumsum(costs)
+		self.frontier = cumulative_costs + np.minimum.accumulate(np.minimum(previous[1:], previous[:-1]) + costs - cumulative_costs)
+		self.frontier_start = start + 1
+		self.best_word_i = start + np.argmin(self.frontier)
+		return self.line_Y.index(self.word_XY[self.best_word_i, 1])
+
+
+@register(inputs=('line_Y', 'word_XY'), deterministic=True, complexity='O(nw), or O(nb) with band b', cost=lambda params: (10, 2) if params['band'] is None else (2 * params['band'] + 1, 1), modes=('batch', 'online'))
+def online_warp(fixation_XY, line_Y, word_XY, band=None, return_line_assignments=False):
+	aligner = OnlineWarp(line_Y, word_XY, band)
+	line_assignments = np.array([aligner.advance(fixation_xy) for fixation_xy in fixation_XY], dtype=int)
+	######################### FOR SIMULATIONS #########################
+	if return_line_assignments:
+		return line_assignments
+	###################################################################
+	fixation_XY[:, 1] = line_Y[line_assignments]
+	return fixation_XY
+
+
 def dynamic_time_warping(sequence1, sequence2):
 	n1 = len(sequence1)
 	n2 = len(sequence2)
+	profiling.count('dtw_cells', n1 * n2)
 	dtw_cost = np.zeros((n1+1, n2+1))
 	dtw_cost[0, :] = np.inf
 	dtw_cost[:, 0] = np.inf
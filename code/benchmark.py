@@ -0,0 +1,189 @@
+'''
+Code for benchmarking how the runtime and memory use of the algorithms
+scale with the size of the trial. Trials are generated with
+simulation.ReadingScenario at controlled sizes (number of lines and
+characters per line) under each distortion factor. Each algorithm is
+timed in both the pipeline implementation (code/algorithms.py) and the
+reference implementation (algorithms/Python/drift_algorithms.py), and
+an empirical complexity exponent is fitted to the runtimes. A report
+can be compared against a stored baseline to flag regressions.
+'''
+
+import sys
+import json
+import random
+import tracemalloc
+from time import perf_counter
+import numpy as np
+import algorithms
+import core
+import simulation
+
+sys.path.insert(0, str(core.ROOT / 'algorithms' / 'Python'))
+import drift_algorithms
+
+
+# Passage sizes as (lines, max characters per line), ranging from around
+# 50 to around 5000 fixations
+sizes = [(4, 80), (8, 80), (12, 80), (25, 120), (50, 160), (50, 320), (50, 600)]
+
+# Each distortion factor is benchmarked at the middle of its range
+# (noise, shift, etc.), plus an undistorted baseline
+scenarios = {'none':{}, 'noise':{'noise':20}, 'slope':{'slope':0.05}, 'shift':{'shift':0.1}, 'regression_within':{'regression_within':0.5}, 'regression_between':{'regression_between':0.5}}
+
+
+def run_pipeline(method, fixation_XY, passage):
+	return algorithms.correct_drift(method, fixation_XY, passage)
+
+def has_reference(method):
+	return callable(getattr(drift_algorithms, method, None))
+
+def run_reference(method, fixation_XY, passage):
+	'''
+	Run the reference implementation of a method. The reference versions
+	of the methods that need the word positions take them in place of
+	the line positions.
+	'''
+	if not has_reference(method):
+		raise ValueError(f'{method} has no reference implementation in drift_algorithms.py')
+	function = getattr(drift_algorithms, method)
+	fixation_XY = np.array(fixation_XY, dtype=int)
+	if 'word_XY' in algorithms.registry[method]['inputs']:
+		return function(fixation_XY, np.array(passage.word_centers(), dtype=int))
+	return function(fixation_XY, np.array(passage.midlines, dtype=int))
+
+implementations = {'pipeline':run_pipeline, 'reference':run_reference}
+
+
+def generate_trials(sizes, scenarios, seed):
+	'''
+	Generate one trial for each combination of size and scenario.
+	'''
+	np.random.seed(seed)
+	random.seed(seed)
+	trials = []
+	for scenario, params in scenarios.items():
+		for n_lines, n_characters in sizes:
+			reading_scenario = simulation.ReadingScenario(lines_per_passage=(n_lines, n_lines), max_characters_per_line=n_characters, **params)
+			passage, fixation_XY, _ = reading_scenario.simulate()
+			trials.append((scenario, n_lines, n_characters, passage, fixation_XY))
+	return trials
+
+def time_call(function, args, repeats):
+	times = []
+	for _ in range(repeats):
+		start_time = perf_counter()
+		function(*args)
+		times.append(perf_counter() - start_time)
+	return min(times)
+
+def peak_memory(function, args):
+	tracemalloc.start()
+	function(*args)
+	_, peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+	return peak
+
+def run_benchmark(methods, sizes, scenarios, repeats=3, time_limit=60, seed=117):
+	'''
+	Time every method in every implementation on every trial. Once a
+	method takes longer than the time limit on some trial, it is skipped
+	for larger trials of the same scenario. Returns a list of records.
+	'''
+	trials = generate_trials(sizes, scenarios, seed)
+	methods = sorted(methods, key=lambda method: algorithms.registry[method]['cost'][::-1]) # cheapest first
+	records = []
+	for implementation, runner in implementations.items():
+		for method in methods:
+			if implementation == 'reference' and not has_reference(method):
+				print(f'{method} has no reference implementation')
+				continue
+			too_slow = set()
+			for scenario, n_lines, n_characters, passage, fixation_XY in trials:
+				if scenario in too_slow:
+					continue
+				print(f'{implementation} {method} {scenario} {len(fixation_XY)} fixations')
+				args = (method, fixation_XY, passage)
+				wall_time = time_call(runner, args, repeats)
+				records.append({'implementation':implementation, 'method':method, 'scenario':scenario, 'n_lines':n_lines, 'n_characters':n_characters, 'n_fixations':len(fixation_XY), 'time':wall_time, 'peak_memory':peak_memory(runner, args)})
+				if wall_time > time_limit:
+					too_slow.add(scenario)
+	return records
+
+def fit_exponents(records):
+	'''
+	Fit time = c * n^k on a log-log scale, where n is the number of
+	fixations, for each implementation, method, and scenario. Returns
+	the exponent k for each.
+	'''
+	groups = {}
+	for record in records:
+		key = f"{record['implementation']}/{record['method']}/{record['scenario']}"
+		groups.setdefault(key, []).append((record['n_fixations'], record['time']))
+	exponents = {}
+	for key, points in groups.items():
+		if len(points) < 2:
+			continue
+		n, t = np.array(points, dtype=float).T
+		exponent, _ = np.polyfit(np.log(n), np.log(np.maximum(t, 1e-9)), 1)
+		exponents[key] = exponent
+	return exponents
+
+def compare_to_baseline(report, baseline, tolerance=1.25):
+	'''
+	Flag every measurement that is more than some factor slower (or
+	uses that much more memory) than the same measurement in the
+	baseline report.
+	'''
+	def key(record):
+		return (record['implementation'], record['method'], record['scenario'], record['n_lines'], record['n_characters'])
+	baseline_records = {key(record):record for record in baseline['records']}
+	regressions = []
+	for record in report['records']:
+		base = baseline_records.get(key(record))
+		if base is None:
+			continue
+		for measure in ['time', 'peak_memory']:
+			if base[measure] > 0 and record[measure] / base[measure] > tolerance:
+				regressions.append({'key':key(record), 'measure':measure, 'baseline':base[measure], 'current':record[measure], 'ratio':record[measure] / base[measure]})
+	return regressions
+
+
+if __name__ == '__main__':
+
+	import argparse
+	parser = argparse.ArgumentParser()
+	parser.add_argument('output', action='store', type=str, help='file to write the JSON report to')
+	parser.add_argument('--methods', action='store', nargs='+', default=core.algorithms, help='algorithms to benchmark')
+	parser.add_argument('--scenarios', action='store', nargs='+', default=list(scenarios), help='distortion scenarios to benchmark')
+	parser.add_argument('--max_fixations', action='store', type=int, default=None, help='only use sizes with at most roughly this many fixations')
+	parser.add_argument('--repeats', action='store', type=int, default=3, help='number of timings per measurement (the minimum is kept)')
+	parser.add_argument('--time_limit', action='store', type=float, default=60, help='skip larger trials once a method exceeds this many seconds')
+	parser.add_argument('--seed', action='store', type=int, default=117, help='random seed for generating the trials')
+	parser.add_argument('--baseline', action='store', type=str, default=None, help='baseline report to check for regressions')
+	parser.add_argument('--tolerance', action='store', type=float, default=1.25, help='ratio above the baseline that counts as a regression')
+	args = parser.parse_args()
+
+	selected_sizes = sizes
+	if args.max_fixations:
+		# About one fixation per 6 characters of text
+		selected_sizes = [(l, c) for l, c in sizes if l * c / 6 <= args.max_fixations]
+	selected_scenarios = {scenario:scenarios[scenario] for scenario in args.scenarios}
+
+	records = run_benchmark(args.methods, selected_sizes, selected_scenarios, args.repeats, args.time_limit, args.seed)
+	report = {'seed':args.seed, 'repeats':args.repeats, 'records':records, 'exponents':fit_exponents(records)}
+	for key, exponent in report['exponents'].items():
+		print(f'{key:<50} n^{exponent:.2f}')
+
+	if args.baseline:
+		with open(args.baseline, encoding='utf-8') as file:
+			baseline = json.load(file)
+		report['regressions'] = compare_to_baseline(report, baseline, args.tolerance)
+		for regression in report['regressions']:
+			print('REGRESSION: %s %s is %.2fx the baseline' % ('/'.join(map(str, regression['key'])), regression['measure'], regression['ratio']))
+
+	with open(args.output, mode='w', encoding='utf-8') as file:
+		json.dump(report, file, indent='\t')
+
+	if report.get('regressions'):
+		sys.exit(1)
@@ -1,7 +1,6 @@
 from os.path import splitext
 from pathlib import Path
 import re
-import cairosvg
 
 # Paths to common directories
 ROOT = Path(__file__).parent.parent
@@ -37,10 +36,10 @@ colors = {'attach':'#81818D',
 algorithms = ['attach', 'chain', 'cluster', 'compare', 'merge', 'regress', 'segment', 'split', 'stretch', 'warp']
 
 # Algorithms without attach
-true_algorithms = ['chain', 'cluster', 'compare', 'merge', 'regress', 'segment', 'split', 'stretch', 'warp']
+true_algorithms = [algorithm for algorithm in algorithms if algorithm != 'attach']
 
 # Algorithms without compare
-good_algorithms = ['attach', 'chain', 'cluster', 'merge', 'regress', 'segment', 'split', 'stretch', 'warp']
+good_algorithms = [algorithm for algorithm in algorithms if algorithm != 'compare']
 
 # Simulation factors and their parameter spaces
 factors = {'noise':('Noise distortion', (0, 40)),
@@ -50,39 +49,63 @@ factors = {'noise':('Noise distortion', (0, 40)),
            'regression_between':('Probability of between-line regression', (0, 1))}
 
 
+def format_svg(svg, monospace=[], arbitrary_replacements={}):
+	'''
+	Applies the label formatting described in format_svg_labels() to an
+	SVG string. All the rewrites are compiled into a single pattern and
+	applied in one pass: font families are set to Helvetica, text elements
+	ending in a check mark or one of the monospace words are set in Menlo,
+	and the arbitrary replacements are made (simultaneously, rather than
+	one after the other).
+	'''
+	rewrites = [r'(?P<font>font-family:.*?;)']
+	if arbitrary_replacements:
+		finds = sorted(arbitrary_replacements, key=len, reverse=True)
+		rewrites.append('(?P<find>%s)' % '|'.join(map(re.escape, finds)))
+	text_pattern = re.compile('|'.join(rewrites))
+	pattern = re.compile('|'.join([r'(?P<text><text.*?</text>)'] + rewrites))
+	monospace_endings = tuple(['✔'] + list(monospace))
+	def rewrite(match):
+		if match.lastgroup == 'font':
+			return 'font-family:Helvetica Neue;'
+		if match.lastgroup == 'find':
+			return arbitrary_replacements[match.group(0)]
+		text = text_pattern.sub(rewrite, match.group(0))
+		if match.group(0)[:-len('</text>')].endswith(monospace_endings):
+			text = text.replace('Helvetica Neue', 'Menlo')
+		return text
+	return pattern.sub(rewrite, svg)
+
 def format_svg_labels(svg_file_path, monospace=[], arbitrary_replacements={}):
 	'''
 	Applies some nicer formatting to an Matplotlib plots, including setting the
 	font to Helvetica and using a monospaced font for algorithm names. The
 	following must be set at the top of the script:
 		plt.rcParams['svg.fonttype'] = 'none'
+	The formatted SVG is also returned, so that it can be passed straight to
+	convert_svg() without reading the file again.
 	'''
 	with open(svg_file_path, mode='r', encoding='utf-8') as file:
-		svg = file.read()
-	svg = re.sub(r'font-family:.*?;', 'font-family:Helvetica Neue;', svg)
-	for check in re.finditer('<text.*?✔</text>', svg):
-		if check:
-			svg = svg.replace(check.group(0), check.group(0).replace('Helvetica Neue', 'Menlo'))
-	for word in monospace:
-		for matched_line in re.finditer('<text.*?%s</text>'%word, svg):
-			if matched_line:
-				svg = svg.replace(matched_line.group(0), matched_line.group(0).replace('Helvetica Neue', 'Menlo'))
-	for find, replace in arbitrary_replacements.items():
-		svg = svg.replace(find, replace)
+		svg = format_svg(file.read(), monospace, arbitrary_replacements)
 	with open(svg_file_path, mode='w', encoding='utf-8') as file:
 		file.write(svg)
+	return svg
 
-def convert_svg(svg_file_path, out_file_path):
+def convert_svg(svg, out_file_path):
 	'''
-	Convert an SVG file into PDF, EPS, or PNG. This function is essentially a
-	wrapper around CairoSVG.
+	Convert an SVG into PDF, EPS, or PNG. The SVG can be given as a file path
+	or as the SVG itself (a string or bytes), in which case it is converted
+	in memory. This function is essentially a wrapper around CairoSVG, which
+	is only imported when needed.
 	'''
+	import cairosvg
 	_, extension = splitext(out_file_path)
-	if extension == '.pdf':
-		cairosvg.svg2pdf(url=svg_file_path, write_to=out_file_path)
-	elif extension == '.eps':
-		cairosvg.svg2eps(url=svg_file_path, write_to=out_file_path)
-	elif extension == '.png':
-		cairosvg.svg2png(url=svg_file_path, write_to=out_file_path)
-	else:
+	converters = {'.pdf':cairosvg.svg2pdf, '.eps':cairosvg.svg2eps, '.png':cairosvg.svg2png}
+	if extension not in converters:
 		raise ValueError('Cannot save to this format. Use either .pdf, .eps, or .png')
+	if isinstance(svg, bytes):
+		converters[extension](bytestring=svg, write_to=out_file_path)
+	elif isinstance(svg, str) and svg.lstrip().startswith('<'):
+		converters[extension](bytestring=svg.encode('utf-8'), write_to=out_file_path)
+	else:
+		converters[extension](url=str(svg), write_to=out_file_path)
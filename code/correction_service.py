@@ -0,0 +1,276 @@
+'''
+A long-lived local correction service, so that lab stations can correct
+trials without paying the Python, sklearn, and scipy startup costs for
+every trial. The service listens on localhost over HTTP, keeps the
+passages and a pool of worker processes warm, and accepts correction
+requests with fixations in eyekit's format ([x, y, start, end] or
+[x, y, start, end, discarded]). Requests that arrive close together are
+micro-batched: the dispatcher collects up to batch_size requests (waiting
+at most batch_wait seconds), and each method's share of the batch is
+spread over the workers in sub-batches, so that a burst of requests for
+one method is corrected in parallel while the inter-process overhead is
+still shared within each sub-batch. At most max_queue requests can be in flight
+(queued, batched, or being corrected) at once; beyond that, new requests
+are rejected with status 503 so that clients can back off. Throughput and
+latency counters are available at /stats.
+
+Start the service with:
+
+	python correction_service.py --port 8117
+
+and use CorrectionClient.correct_drift as a drop-in for
+algorithms.correct_drift, passing a passage ID instead of a passage.
+'''
+
+from concurrent.futures import Future, ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from collections import deque
+from time import perf_counter
+import json
+import os
+import queue
+import threading
+import urllib.error
+import urllib.request
+import numpy as np
+import algorithms
+import core
+
+
+def init_worker(passages_path):
+	global worker_passages
+	import eyekit
+	worker_passages = eyekit.io.read(passages_path)
+	for module in ['sklearn.cluster', 'scipy.optimize', 'scipy.stats']:
+		__import__(module) # warm up the lazily imported dependencies
+
+def correct_batch(method, jobs):
+	'''
+	Correct a batch of (fixation_XY, passage_id, params,
+	return_line_assignments) jobs with the same method. Returns an
+	(output, truncated) pair for each job, where truncated indicates that
+	an anytime method ran out of its time or evaluation budget.
+	'''
+	outputs = []
+	for fixation_XY, passage_id, params, return_line_assignments in jobs:
+		params = {name:value for name, value in params.items() if name != 'return_truncated'}
+		output, truncated = algorithms.correct_drift(method, fixation_XY, worker_passages[passage_id], return_line_assignments=return_line_assignments, return_truncated=True, **params)
+		outputs.append((np.asarray(output).tolist(), bool(truncated)))
+	return outputs
+
+
+class CorrectionService:
+
+	def __init__(self, passages_path=core.DATA / 'passages.json', batch_size=16, batch_wait=0.005, max_queue=256, n_processes=None):
+		import eyekit
+		self.passage_ids = set(eyekit.io.read(passages_path))
+		self.batch_size = batch_size
+		self.batch_wait = batch_wait
+		self.queue = queue.Queue()
+		self.slots = threading.BoundedSemaphore(max_queue)
+		self.in_flight = 0
+		self.n_workers = n_processes or os.cpu_count()
+		self.executor = ProcessPoolExecutor(self.n_workers, initializer=init_worker, initargs=(passages_path,))
+		self.start_time = perf_counter()
+		self.lock = threading.Lock()
+		self.counters = {'received':0, 'completed':0, 'failed':0, 'rejected':0, 'batches':0}
+		self.latencies = deque(maxlen=1000)
+		threading.Thread(target=self._dispatch, daemon=True).start()
+
+	def submit(self, method, fixation_XY, passage_id, params=None, return_line_assignments=False):
+		'''
+		Queue a correction and return a Future for its output. Raises
+		queue.Full if max_queue requests are already in flight.
+		'''
+		if method not in algorithms.registry:
+			raise ValueError(f'Unknown method {method}')
+		if passage_id not in self.passage_ids:
+			raise ValueError(f'Unknown passage {passage_id}')
+		future = Future()
+		job = {'method':method, 'args':(np.array(fixation_XY, dtype=int), passage_id, params or {}, return_line_assignments), 'future':future, 'received':perf_counter()}
+		if not self.slots.acquire(blocking=False):
+			self._count('rejected')
+			raise queue.Full
+		with self.lock:
+			self.counters['received'] += 1
+			self.in_flight += 1
+		self.queue.put(job)
+		return future
+
+	def _count(self, counter, amount=1):
+		with self.lock:
+			self.counters[counter] += amount
+
+	def _dispatch(self):
+		while True:
+			batch = [self.queue.get()]
+			deadline = perf_counter() + self.batch_wait
+			while len(batch) < self.batch_size:
+				remaining = deadline - perf_counter()
+				if remaining <= 0:
+					break
+				try:
+					batch.append(self.queue.get(timeout=remaining))
+				except queue.Empty:
+					break
+			groups = {}
+			for job in batch:
+				groups.setdefault(job['method'], []).append(job)
+			for method, method_jobs in groups.items():
+				sub_batch_size = -(-len(method_jobs) // self.n_workers) # ceiling division
+				for start in range(0, len(method_jobs), sub_batch_size):
+					self._submit(method, method_jobs[start:start+sub_batch_size])
+
+	def _submit(self, method, jobs):
+		self._count('batches')
+		try:
+			batch_future = self.executor.submit(correct_batch, method, [job['args'] for job in jobs])
+		except Exception as error: # e.g. the pool is broken or shut down
+			self._fail(jobs, error)
+			return
+		batch_future.add_done_callback(lambda batch_future: self._deliver(batch_future, jobs))
+
+	def _release(self, jobs):
+		with self.lock:
+			self.in_flight -= len(jobs)
+		for job in jobs:
+			self.slots.release()
+
+	def _fail(self, jobs, error):
+		self._count('failed', len(jobs))
+		self._release(jobs)
+		for job in jobs:
+			job['future'].set_exception(error)
+
+	def _deliver(self, batch_future, jobs):
+		try:
+			outputs = batch_future.result()
+		except Exception as error:
+			self._fail(jobs, error)
+			return
+		now = perf_counter()
+		with self.lock:
+			for job, output in zip(jobs, outputs):
+				self.latencies.append(now - job['received'])
+			self.counters['completed'] += len(jobs)
+		self._release(jobs)
+		for job, output in zip(jobs, outputs):
+			job['future'].set_result(output)
+
+	def stats(self):
+		with self.lock:
+			latencies = np.array(self.latencies) * 1000
+			stats = dict(self.counters)
+			stats['in_flight'] = self.in_flight
+		uptime = perf_counter() - self.start_time
+		stats.update({'uptime':uptime, 'throughput':stats['completed'] / uptime, 'queue_length':self.queue.qsize()})
+		if len(latencies):
+			stats.update({'latency_mean_ms':latencies.mean(), 'latency_p50_ms':np.percentile(latencies, 50), 'latency_p95_ms':np.percentile(latencies, 95)})
+		return stats
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+
+	def _respond(self, status, content):
+		body = json.dumps(content).encode('utf-8')
+		self.send_response(status)
+		self.send_header('Content-Type', 'application/json')
+		self.send_header('Content-Length', str(len(body)))
+		if status == 503:
+			self.send_header('Retry-After', '1')
+		self.end_headers()
+		self.wfile.write(body)
+
+	def do_GET(self):
+		if self.path == '/stats':
+			self._respond(200, self.server.service.stats())
+		else:
+			self._respond(404, {'error':'not found'})
+
+	def do_POST(self):
+		if self.path != '/correct':
+			self._respond(404, {'error':'not found'})
+			return
+		try:
+			request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+			fixations = request['fixations']
+			fixation_XY = [fixation[:2] for fixation in fixations]
+			return_line_assignments = request.get('return_line_assignments', False)
+			future = self.server.service.submit(request['method'], fixation_XY, request['passage_id'], request.get('params'), return_line_assignments)
+		except queue.Full:
+			self._respond(503, {'error':'service at capacity'})
+			return
+		except (KeyError, TypeError, ValueError) as error:
+			self._respond(400, {'error':str(error)})
+			return
+		try:
+			output, truncated = future.result()
+		except Exception as error:
+			self._respond(500, {'error':str(error)})
+			return
+		if return_line_assignments:
+			self._respond(200, {'line_assignments':output, 'truncated':truncated})
+		else:
+			corrected = [[fixation[0], xy[1]] + list(fixation[2:]) for fixation, xy in zip(fixations, output)]
+			self._respond(200, {'fixations':corrected, 'truncated':truncated})
+
+	def log_message(self, format, *args):
+		pass # don't log every request
+
+
+def serve(port=8117, **service_params):
+	server = ThreadingHTTPServer(('127.0.0.1', port), RequestHandler)
+	server.service = CorrectionService(**service_params)
+	print(f'Correction service listening on http://127.0.0.1:{port}')
+	server.serve_forever()
+
+
+class CorrectionClient:
+
+	def __init__(self, url='http://127.0.0.1:8117', max_retries=10):
+		self.url = url
+		self.max_retries = max_retries
+
+	def _request(self, path, content=None):
+		data = None if content is None else json.dumps(content).encode('utf-8')
+		for attempt in range(self.max_retries):
+			request = urllib.request.Request(self.url + path, data=data, headers={'Content-Type':'application/json'})
+			try:
+				with urllib.request.urlopen(request) as response:
+					return json.loads(response.read())
+			except urllib.error.HTTPError as error:
+				if error.code != 503 or attempt == self.max_retries - 1:
+					raise
+				threading.Event().wait(0.05 * 2 ** attempt) # back off while the service is busy
+
+	def correct_drift(self, method, fixation_XY, passage_id, return_line_assignments=False, return_truncated=False, **params):
+		'''
+		Drop-in for algorithms.correct_drift that is run by the service.
+		The passage is given by its ID in passages.json.
+		'''
+		fixations = [[int(x), int(y)] for x, y in fixation_XY]
+		response = self._request('/correct', {'method':method, 'fixations':fixations, 'passage_id':passage_id, 'params':params, 'return_line_assignments':return_line_assignments})
+		if return_line_assignments:
+			output = np.array(response['line_assignments'], dtype=int)
+		else:
+			output = np.array(response['fixations'], dtype=int)
+		if return_truncated:
+			return output, response['truncated']
+		return output
+
+	def stats(self):
+		return self._request('/stats')
+
+
+if __name__ == '__main__':
+
+	import argparse
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--port', action='store', type=int, default=8117, help='port to listen on (localhost only)')
+	parser.add_argument('--batch_size', action='store', type=int, default=16, help='maximum number of requests per batch')
+	parser.add_argument('--batch_wait', action='store', type=float, default=0.005, help='maximum time to wait for a batch to fill (seconds)')
+	parser.add_argument('--max_queue', action='store', type=int, default=256, help='maximum number of requests in flight before rejecting new ones')
+	parser.add_argument('--n_processes', action='store', type=int, default=None, help='number of worker processes')
+	args = parser.parse_args()
+
+	serve(args.port, batch_size=args.batch_size, batch_wait=args.batch_wait, max_queue=args.max_queue, n_processes=args.n_processes)
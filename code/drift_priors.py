@@ -0,0 +1,69 @@
+'''
+A cache of drift priors, so that regress and stretch can start their
+optimization from the parameters previously fitted for the same
+participant (and session) rather than from scratch. A participant's
+drift tends to be consistent across their trials, so starting nearby
+cuts the number of objective evaluations. The cache is stored as JSON
+so that it persists across batch runs:
+
+	priors = DriftPriors(core.DATA / 'drift_priors.json')
+	prior = priors.prior(trial['participant_id'])
+	algorithms.correct_drift('regress', fixation_XY, passage, prior=prior)
+	priors.save()
+'''
+
+import json
+from pathlib import Path
+
+
+class DriftPrior:
+
+	def __init__(self, fits=None):
+		self.fits = {} if fits is None else fits
+
+	def get(self, method):
+		'''
+		The mean of the parameters fitted so far by a method, or None if
+		it has not been fitted yet.
+		'''
+		if method not in self.fits:
+			return None
+		return self.fits[method]['params']
+
+	def update(self, method, params):
+		'''
+		Add a newly fitted set of parameters to the running mean.
+		'''
+		params = [float(param) for param in params]
+		if method not in self.fits:
+			self.fits[method] = {'params':params, 'n_trials':1}
+			return
+		fit = self.fits[method]
+		fit['n_trials'] += 1
+		fit['params'] = [mean + (param - mean) / fit['n_trials'] for mean, param in zip(fit['params'], params)]
+
+
+class DriftPriors:
+
+	def __init__(self, file_path=None):
+		self.file_path = None if file_path is None else Path(file_path)
+		self.priors = {}
+		if self.file_path is not None and self.file_path.exists():
+			with open(self.file_path, encoding='utf-8') as file:
+				self.priors = {key:DriftPrior(fits) for key, fits in json.load(file).items()}
+
+	def prior(self, participant_id, session=None):
+		'''
+		The drift prior for a participant, or for one of their sessions
+		if a session is given; it is created if it doesn't exist yet.
+		'''
+		key = str(participant_id) if session is None else f'{participant_id}/{session}'
+		if key not in self.priors:
+			self.priors[key] = DriftPrior()
+		return self.priors[key]
+
+	def save(self, file_path=None):
+		if file_path is None:
+			file_path = self.file_path
+		with open(file_path, mode='w', encoding='utf-8') as file:
+			json.dump({key:prior.fits for key, prior in self.priors.items()}, file, indent='\t')
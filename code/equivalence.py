@@ -0,0 +1,134 @@
+'''
+Code for checking that an alternative (e.g. optimized) implementation of
+the algorithms produces the same line assignments as the implementations
+that generated the published results. Each method is run by a reference
+engine and a candidate engine side by side over a fixed-seed corpus made
+up of the real trials in sample.json and a set of simulated trials. Any
+fixation-level disagreements are reported along with the runtime ratio.
+
+An engine is any function with the signature
+
+	engine(method, fixation_XY, passage) -> line assignments
+
+and a module can be used as a candidate engine if it provides a
+correct_drift function with the same signature as the one in
+algorithms.py.
+'''
+
+import json
+import random
+import importlib
+from time import perf_counter
+import numpy as np
+import eyekit
+import algorithms
+import benchmark
+import core
+import simulation
+
+
+# Proportion of fixations that may disagree before a method fails; the
+# remaining methods must match exactly
+tolerances = {'cluster':0.01, 'regress':0.01, 'split':0.01, 'stretch':0.01}
+
+
+def pipeline_engine(method, fixation_XY, passage):
+	return algorithms.correct_drift(method, fixation_XY, passage, return_line_assignments=True)
+
+def reference_engine(method, fixation_XY, passage):
+	corrected_XY = benchmark.run_reference(method, fixation_XY, passage)
+	line_Y = list(np.array(passage.midlines, dtype=int))
+	return np.array([line_Y.index(y) for y in corrected_XY[:, 1]], dtype=int)
+
+engines = {'pipeline':pipeline_engine, 'reference':reference_engine}
+
+def load_engine(name):
+	'''
+	Get one of the built-in engines by name or load the correct_drift
+	function from a module.
+	'''
+	if name in engines:
+		return engines[name]
+	module = importlib.import_module(name)
+	def engine(method, fixation_XY, passage):
+		return module.correct_drift(method, fixation_XY, passage, return_line_assignments=True)
+	return engine
+
+
+def build_corpus(n_simulated=50, seed=117):
+	'''
+	Returns a list of (trial_id, passage, fixation_XY) tuples containing
+	all the real trials followed by simulated trials. The simulated
+	trials are drawn from a fixed seed, with every factor set to a random
+	value in its parameter space, so the corpus is identical on every
+	run.
+	'''
+	corpus = []
+	sample_data = eyekit.io.read(core.FIXATIONS / 'sample.json')
+	passages = eyekit.io.read(core.DATA / 'passages.json')
+	for trial_id, trial in sample_data.items():
+		fixation_XY = np.array([fixation.xy for fixation in trial['fixations']], dtype=int)
+		corpus.append((trial_id, passages[trial['passage_id']], fixation_XY))
+	np.random.seed(seed)
+	random.seed(seed)
+	for sim_i in range(n_simulated):
+		params = {factor:np.random.uniform(*bounds) for factor, (_, bounds) in core.factors.items()}
+		passage, fixation_XY, _ = simulation.ReadingScenario(**params).simulate()
+		corpus.append((f'sim_{sim_i}', passage, fixation_XY))
+	return corpus
+
+def timed_run(engine, method, fixation_XY, passage, seed):
+	np.random.seed(seed) # KMeans in cluster and split draws from the global state
+	start_time = perf_counter()
+	line_assignments = engine(method, fixation_XY.copy(), passage)
+	return np.array(line_assignments, dtype=int), perf_counter() - start_time
+
+def compare_engines(reference, candidate, corpus, methods, seed=117):
+	'''
+	Run both engines on every trial in the corpus for each method and
+	report the fixations on which they disagree, the proportion of
+	disagreements, the total runtimes, and whether the method passes
+	given its tolerance.
+	'''
+	report = {}
+	for method in methods:
+		print(method.upper())
+		disagreements = {}
+		n_fixations, n_disagreements = 0, 0
+		reference_time, candidate_time = 0.0, 0.0
+		for trial_i, (trial_id, passage, fixation_XY) in enumerate(corpus):
+			reference_I, time1 = timed_run(reference, method, fixation_XY, passage, seed + trial_i)
+			candidate_I, time2 = timed_run(candidate, method, fixation_XY, passage, seed + trial_i)
+			reference_time += time1
+			candidate_time += time2
+			mismatches = np.where(reference_I != candidate_I)[0]
+			if len(mismatches):
+				disagreements[trial_id] = [int(fixation_i) for fixation_i in mismatches]
+				print('-', trial_id, 'disagrees on %i of %i fixations' % (len(mismatches), len(fixation_XY)))
+			n_fixations += len(fixation_XY)
+			n_disagreements += len(mismatches)
+		proportion = n_disagreements / n_fixations
+		report[method] = {'n_fixations':n_fixations, 'n_disagreements':n_disagreements, 'proportion':proportion, 'passed':proportion <= tolerances.get(method, 0.0), 'reference_time':reference_time, 'candidate_time':candidate_time, 'runtime_ratio':candidate_time / reference_time, 'disagreements':disagreements}
+	return report
+
+
+if __name__ == '__main__':
+
+	import argparse
+	parser = argparse.ArgumentParser()
+	parser.add_argument('candidate', action='store', type=str, help='candidate engine (pipeline, reference, or a module name)')
+	parser.add_argument('--reference', action='store', type=str, default='pipeline', help='reference engine (pipeline, reference, or a module name)')
+	parser.add_argument('--methods', action='store', nargs='+', default=core.algorithms, help='algorithms to compare')
+	parser.add_argument('--n_simulated', action='store', type=int, default=50, help='number of simulated trials in the corpus')
+	parser.add_argument('--seed', action='store', type=int, default=117, help='random seed for the corpus and stochastic methods')
+	parser.add_argument('--output', action='store', type=str, default=None, help='file to write the JSON report to')
+	args = parser.parse_args()
+
+	corpus = build_corpus(args.n_simulated, args.seed)
+	report = compare_engines(load_engine(args.reference), load_engine(args.candidate), corpus, args.methods, args.seed)
+	for method, result in report.items():
+		status = 'PASS' if result['passed'] else 'FAIL'
+		print(f"{method:<10} {status}  {result['n_disagreements']:>6} / {result['n_fixations']} fixations differ  runtime ratio {result['runtime_ratio']:.2f}")
+	if args.output:
+		with open(args.output, mode='w', encoding='utf-8') as file:
+			json.dump(report, file, indent='\t')
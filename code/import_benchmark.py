@@ -0,0 +1,62 @@
+'''
+Code for checking that the lightweight modules stay fast to import. Each
+module is imported in a fresh interpreter, the import time is measured,
+and the check fails if the module eagerly pulls in any of the heavy
+dependencies that should only be loaded on first use.
+'''
+
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+
+CODE = Path(__file__).parent
+
+# Modules that should import quickly and the heavy dependencies they must
+# not load at import time
+lightweight_modules = {'core':['cairosvg', 'sklearn', 'scipy'], 'algorithms':['cairosvg', 'sklearn', 'scipy.optimize', 'scipy.stats']}
+
+PROBE = '''
+import json, sys, time
+start_time = time.perf_counter()
+import {module}
+import_time = time.perf_counter() - start_time
+print(json.dumps({{'time':import_time, 'loaded':[name for name in {heavy} if name in sys.modules]}}))
+'''
+
+
+def measure_import(module, heavy_modules, repeats=5):
+	'''
+	Import a module in a fresh interpreter several times, returning the
+	median import time and the heavy modules that were loaded.
+	'''
+	times, loaded = [], set()
+	for _ in range(repeats):
+		probe = PROBE.format(module=module, heavy=repr(heavy_modules))
+		output = subprocess.run([sys.executable, '-c', probe], cwd=CODE, capture_output=True, text=True, check=True).stdout
+		result = json.loads(output.strip().split('\n')[-1])
+		times.append(result['time'])
+		loaded.update(result['loaded'])
+	times.sort()
+	return times[len(times) // 2], sorted(loaded)
+
+
+if __name__ == '__main__':
+
+	import argparse
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--max_time', action='store', type=float, default=0.5, help='maximum acceptable import time in seconds')
+	parser.add_argument('--repeats', action='store', type=int, default=5, help='number of fresh interpreters per module')
+	args = parser.parse_args()
+
+	failed = False
+	for module, heavy_modules in lightweight_modules.items():
+		import_time, loaded = measure_import(module, heavy_modules, args.repeats)
+		status = 'OK'
+		if loaded or import_time > args.max_time:
+			status = 'FAIL'
+			failed = True
+		print(f'{module:<12} {import_time*1000:8.1f}ms  {status}' + (f"  (loaded {', '.join(loaded)})" if loaded else ''))
+	if failed:
+		sys.exit(1)
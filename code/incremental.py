@@ -0,0 +1,131 @@
+'''
+Code for incrementally re-correcting a trial after a manual edit, so that
+interactive correction tools can update the line assignments as soon as a
+corrector fixes a fixation, without solving the whole trial again. Given
+the line assignments previously produced by an algorithm and a set of
+pinned fixations (fixation index -> line index), only the region around
+the pins is recomputed:
+
+- chain: the chains that contain a pinned fixation
+- merge: the initial sequences that contain a pinned fixation
+- warp: a window of fixations around the pins, realigned by DTW to the
+  words on nearby lines, with pinned fixations constrained to their line
+
+For the other algorithms, the pins are applied to the previous line
+assignments. The pins are always respected in the output.
+'''
+
+import numpy as np
+import algorithms
+
+
+def spread_pins(line_assignments, start, end, pins):
+	'''
+	Assign every fixation in a run to the line of the most recent pinned
+	fixation (or of the first pinned fixation, if it comes before any).
+	Runs without a pinned fixation are left as they are.
+	'''
+	pinned_I = sorted(fixation_i for fixation_i in pins if start <= fixation_i < end)
+	if not pinned_I:
+		return
+	line_i = pins[pinned_I[0]]
+	for fixation_i in range(start, end):
+		line_i = pins.get(fixation_i, line_i)
+		line_assignments[fixation_i] = line_i
+
+def recorrect_runs(line_assignments, boundaries, pins):
+	boundaries = list(boundaries)
+	for start, end in zip([0]+boundaries, boundaries+[len(line_assignments)]):
+		spread_pins(line_assignments, start, end, pins)
+
+def recorrect_chain(fixation_XY, line_Y, word_XY, line_assignments, pins, x_thresh=192, y_thresh=32, **params):
+	dist_X = abs(np.diff(fixation_XY[:, 0]))
+	dist_Y = abs(np.diff(fixation_XY[:, 1]))
+	recorrect_runs(line_assignments, np.where(np.logical_or(dist_X > x_thresh, dist_Y > y_thresh))[0] + 1, pins)
+
+def recorrect_merge(fixation_XY, line_Y, word_XY, line_assignments, pins, y_thresh=32, **params):
+	diff_X = np.diff(fixation_XY[:, 0])
+	dist_Y = abs(np.diff(fixation_XY[:, 1]))
+	recorrect_runs(line_assignments, np.where(np.logical_or(diff_X < 0, dist_Y > y_thresh))[0] + 1, pins)
+
+def recorrect_warp(fixation_XY, line_Y, word_XY, line_assignments, pins, window=10, **params):
+	n = len(fixation_XY)
+	m = len(line_Y)
+	word_line_I = np.argmin(abs(line_Y[np.newaxis, :] - word_XY[:, 1:2]), axis=1)
+	# Merge the windows around the pins where they overlap
+	windows = []
+	for pinned_i in sorted(pins):
+		start, end = max(0, pinned_i - window), min(n, pinned_i + window + 1)
+		if windows and start <= windows[-1][1]:
+			windows[-1][1] = end
+		else:
+			windows.append([start, end])
+	for start, end in windows:
+		window_pins = {fixation_i:line_i for fixation_i, line_i in pins.items() if start <= fixation_i < end}
+		window_lines = list(line_assignments[start:end]) + list(window_pins.values())
+		first_line, last_line = max(0, min(window_lines) - 1), min(m - 1, max(window_lines) + 1)
+		word_I = np.where(np.logical_and(word_line_I >= first_line, word_line_I <= last_line))[0]
+		allowed = np.ones((end - start, len(word_I)), dtype=bool)
+		for fixation_i, line_i in window_pins.items():
+			allowed[fixation_i - start] = word_line_I[word_I] == line_i
+		warping_path = constrained_warping_path(fixation_XY[start:end], word_XY[word_I], allowed)
+		if warping_path is None:
+			continue # the pins can't be satisfied by a monotonic alignment
+		for fixation_i, words_mapped_to_fixation_i in enumerate(warping_path, start):
+			line_assignments[fixation_i] = algorithms.mode(word_line_I[word_I[words_mapped_to_fixation_i]])
+
+def constrained_warping_path(sequence1, sequence2, allowed):
+	'''
+	Dynamic time warping in which sequence1 may be aligned to any
+	contiguous part of sequence2 (open beginning and end), and in which
+	the cells where allowed is False are forbidden. Returns the indices
+	of sequence2 mapped to each element of sequence1, or None if no
+	alignment is possible.
+	'''
+	n1 = len(sequence1)
+	n2 = len(sequence2)
+	cost = np.sqrt(((sequence1[:, np.newaxis, :] - sequence2[np.newaxis, :, :])**2).sum(axis=2))
+	cost[~allowed] = np.inf
+	dtw_cost = np.full((n1+1, n2+1), np.inf)
+	dtw_cost[0, :] = 0
+	for i in range(n1):
+		for j in range(n2):
+			dtw_cost[i+1, j+1] = cost[i, j] + min(dtw_cost[i, j+1], dtw_cost[i+1, j], dtw_cost[i, j])
+	if not np.isfinite(dtw_cost[n1, 1:]).any():
+		return None
+	i, j = n1, np.argmin(dtw_cost[n1, 1:]) + 1
+	dtw_path = [[] for _ in range(n1)]
+	while i > 0:
+		dtw_path[i-1].append(j-1)
+		best_move = np.argmin([dtw_cost[i-1, j-1], dtw_cost[i-1, j], dtw_cost[i, j-1]])
+		if best_move == 0:
+			i -= 1
+			j -= 1
+		elif best_move == 1:
+			i -= 1
+		else:
+			j -= 1
+	return dtw_path
+
+# Each recorrector takes the parameters it needs and ignores the rest, so
+# that recorrect can be given whatever parameters the method was run with
+recorrectors = {'chain':recorrect_chain, 'merge':recorrect_merge, 'warp':recorrect_warp}
+
+
+def recorrect(method, fixation_XY, passage, line_assignments, pins, **params):
+	'''
+	Update the line assignments previously produced by a method so that
+	they respect the pinned fixations (fixation index -> line index),
+	recomputing only the affected region. params are the parameters the
+	method was run with (or window, the number of fixations either side
+	of a pin that are realigned by warp). Returns new line assignments.
+	'''
+	fixation_XY = np.array(fixation_XY, dtype=int)
+	line_Y = np.array(passage.midlines, dtype=int)
+	word_XY = np.array(passage.word_centers(), dtype=int)
+	line_assignments = np.array(line_assignments, dtype=int)
+	if method in recorrectors:
+		recorrectors[method](fixation_XY, line_Y, word_XY, line_assignments, pins, **params)
+	for fixation_i, line_i in pins.items():
+		line_assignments[fixation_i] = line_i
+	return line_assignments
@@ -1,35 +1,50 @@
+from collections import deque
+import os
+from concurrent.futures import ProcessPoolExecutor
 from PIL import Image
-import imageio
+import numpy as np
 import eyekit
 import core
 
-def make_image(seq, number):
+def render_frame(number):
+	'''
+	Render the frame in which the first n fixations have been corrected
+	straight into memory, returning it as a resized RGB array.
+	'''
+	seq = orig_seq.copy()
+	for of, nf in zip(list(seq)[:number], corr_seq):
+		of.y = nf.y
 	img = eyekit.vis.Image(1920, 1080)
 	img.draw_text_block(txt)
 	img.draw_fixation_sequence(seq, color='DarkSlateGray')
-	img.save(core.VISUALS / 'animation_frames' / f'{number}.png', crop_margin=40)
-
-def make_frames():
-	make_image(orig_seq, 0)
-	for i, (of, nf) in enumerate(zip(orig_seq, corr_seq), 1):
-		of.y = nf.y
-		make_image(orig_seq, i)
-
-def make_animation():
-	images = []
-	for i in range(136):
-		print(i)
-		im = Image.open(str(core.VISUALS / 'animation_frames' / f'{i}.png'))
-		im = im.resize((800, 450))
-		if i == 0:
-			for _ in range(60):
-				images.append(im)
-		elif i == 135:
-			for _ in range(60):
-				images.append(im)
-		else:
-			images.append(im)
-	imageio.mimsave(str(core.VISUALS / 'animation.gif'), images, fps=30, loop=0, palettesize=8, subrectangles=True)
+	# Render as Image.save would for a PNG with a crop margin of 40, but
+	# to an in-memory surface rather than a file
+	surface, context, scale = img._make_surface(None, 'PNG', None, 40)
+	img._render_background(context)
+	img._render_components(context, scale, False)
+	surface.flush()
+	width, height, stride = surface.get_width(), surface.get_height(), surface.get_stride()
+	pixels = np.frombuffer(surface.get_data(), dtype=np.uint8).reshape(height, stride)[:, :width*4].reshape(height, width, 4)
+	im = Image.fromarray(np.ascontiguousarray(pixels[:, :, 2::-1])) # cairo stores pixels as BGRA
+	return np.asarray(im.resize((800, 450)))
+
+def make_animation(output_path, fps=30, hold=2, n_processes=None):
+	'''
+	Render the frames in parallel and stream them into the GIF encoder in
+	order. The first and last frames are held for some number of seconds
+	by giving them a longer duration.
+	'''
+	import imageio
+	n_frames = len(orig_seq) + 1
+	durations = [hold] + [1 / fps] * (n_frames - 2) + [hold]
+	with ProcessPoolExecutor(n_processes) as executor, imageio.get_writer(str(output_path), mode='I', duration=durations, loop=0, palettesize=8, subrectangles=True) as writer:
+		pending, max_pending = deque(), 2 * (n_processes or os.cpu_count())
+		for i in range(n_frames):
+			pending.append(executor.submit(render_frame, i))
+			if len(pending) > max_pending:
+				writer.append_data(pending.popleft().result())
+		while pending:
+			writer.append_data(pending.popleft().result())
 
 
 data = eyekit.io.read(core.FIXATIONS / 'sample.json')
@@ -40,5 +55,6 @@ corr_seq = orig_seq.copy()
 
 eyekit.tools.snap_to_lines(corr_seq, txt)
 
-# make_frames()
-make_animation()
+if __name__ == '__main__':
+
+	make_animation(core.VISUALS / 'animation.gif')
@@ -0,0 +1,156 @@
+'''
+Code for fast raster previews of trials, for visual QA of large corpora.
+Rather than rendering vector PDFs through eyekit and cairo, each trial is
+drawn straight into a small NumPy image: the word boxes of the passage
+in gray (drawn once per passage and cached) and the fixations colored by
+the line they were assigned to. Fixations on which the methods disagree
+are drawn in red, and trials with disagreement are framed in red, so
+that only flagged trials need to be checked in the full PDFs. The
+previews are tiled into contact sheets of hundreds of trials:
+
+	python preview.py --methods chain merge warp
+
+writes the contact sheets to visuals/previews along with an index of
+which trial is in each tile and a list of the flagged trials.
+'''
+
+from pathlib import Path
+import numpy as np
+import core
+
+
+# Colors used for the lines of text, cycled if there are more lines
+line_colors = np.array([[31, 119, 180], [255, 127, 14], [44, 160, 44], [148, 103, 189], [140, 86, 75], [227, 119, 194], [127, 127, 127], [188, 189, 34], [23, 190, 207]], dtype=np.uint8)
+word_color = np.array([225, 225, 225], dtype=np.uint8)
+disagreement_color = np.array([214, 39, 40], dtype=np.uint8)
+
+
+_passage_layers = {}
+
+def passage_layer(passage, scale, screen_width=1920, screen_height=1080):
+	'''
+	A white image of the screen with the passage's word boxes drawn in
+	gray, cached per passage and scale.
+	'''
+	key = (id(passage), scale)
+	if key not in _passage_layers:
+		image = np.full((int(screen_height * scale), int(screen_width * scale), 3), 255, dtype=np.uint8)
+		for word in passage.words():
+			image[int(word.y_tl * scale):int(np.ceil(word.y_br * scale)), int(word.x_tl * scale):int(np.ceil(word.x_br * scale))] = word_color
+		_passage_layers[key] = (passage, image)
+	return _passage_layers[key][1]
+
+def draw_points(image, XY, color, scale, radius=1):
+	'''
+	Draw a square of some radius (in preview pixels) at each point.
+	'''
+	height, width, _ = image.shape
+	X = np.clip((XY[:, 0] * scale).astype(int), 0, width - 1)
+	Y = np.clip((XY[:, 1] * scale).astype(int), 0, height - 1)
+	for offset_y in range(-radius, radius + 1):
+		for offset_x in range(-radius, radius + 1):
+			image[np.clip(Y + offset_y, 0, height - 1), np.clip(X + offset_x, 0, width - 1)] = color
+
+def render_preview(passage, fixation_XY, line_assignments, disagreements=None, scale=0.125):
+	'''
+	Draw a trial: the fixations in their original positions, colored by
+	their assigned line, with disagreements (if given) in red.
+	'''
+	image = passage_layer(passage, scale).copy()
+	fixation_XY = np.asarray(fixation_XY, dtype=float)
+	colors = line_colors[line_assignments % len(line_colors)]
+	colors[line_assignments < 0] = 0 # discarded fixations in black
+	draw_points(image, fixation_XY, colors, scale)
+	if disagreements is not None and disagreements.any():
+		draw_points(image, fixation_XY[disagreements], disagreement_color, scale, radius=2)
+	return image
+
+def line_assignments(fixations, passage):
+	'''
+	The line each fixation in an eyekit fixation sequence is on, or -1 for
+	discarded fixations.
+	'''
+	line_Y = np.array(passage.midlines)
+	assignments = np.argmin(abs(line_Y[np.newaxis, :] - np.array([[fixation.y] for fixation in fixations])), axis=1)
+	assignments[[fixation.discarded for fixation in fixations]] = -1
+	return assignments
+
+def method_disagreements(assignments):
+	'''
+	Given a (method, fixation) array of line assignments, return which
+	fixations the methods don't all agree on.
+	'''
+	return np.any(assignments != assignments[0], axis=0)
+
+def contact_sheet(tiles, flagged, n_cols=10, gap=4):
+	'''
+	Tile previews into a single image, with flagged tiles framed in red.
+	'''
+	tile_height, tile_width, _ = tiles[0].shape
+	n_rows = int(np.ceil(len(tiles) / n_cols))
+	sheet = np.full((n_rows * (tile_height + gap) + gap, n_cols * (tile_width + gap) + gap, 3), 64, dtype=np.uint8)
+	for tile_i, (tile, flag) in enumerate(zip(tiles, flagged)):
+		y = gap + (tile_i // n_cols) * (tile_height + gap)
+		x = gap + (tile_i % n_cols) * (tile_width + gap)
+		if flag:
+			sheet[y-gap//2:y+tile_height+gap//2, x-gap//2:x+tile_width+gap//2] = disagreement_color
+		sheet[y:y+tile_height, x:x+tile_width] = tile
+	return sheet
+
+def make_contact_sheets(sample_data, passages, outputs, output_dir, tiles_per_sheet=100, n_cols=10, scale=0.125, threshold=0.0):
+	'''
+	Make contact sheets of every trial in the sample data, colored by the
+	first method's line assignments and flagging trials in which the
+	methods disagree on more than some proportion of fixations. Returns
+	a dictionary of flagged trial IDs and their disagreement proportions.
+	'''
+	from PIL import Image
+	output_dir.mkdir(exist_ok=True)
+	tiles, flags, index, flagged = [], [], [], {}
+	def write_sheet():
+		sheet_path = output_dir / f'sheet_{(len(index) - 1) // tiles_per_sheet + 1:03}.png'
+		Image.fromarray(contact_sheet(tiles, flags, n_cols)).save(sheet_path)
+		tiles.clear()
+		flags.clear()
+	for trial_id, trial in sample_data.items():
+		passage = passages[trial['passage_id']]
+		assignments = np.array([line_assignments(output[trial_id]['fixations'], passage) for output in outputs.values()])
+		disagreements = method_disagreements(assignments)
+		proportion = disagreements.mean()
+		fixation_XY = [fixation.xy for fixation in trial['fixations']]
+		tiles.append(render_preview(passage, fixation_XY, assignments[0], disagreements, scale))
+		flags.append(proportion > threshold)
+		index.append(trial_id)
+		if flags[-1]:
+			flagged[trial_id] = float(proportion)
+		if len(tiles) == tiles_per_sheet:
+			write_sheet()
+	if tiles:
+		write_sheet()
+	with open(output_dir / 'index.txt', 'w') as file:
+		file.write('\n'.join(f'{tile_i // tiles_per_sheet + 1:03}\t{tile_i % tiles_per_sheet}\t{trial_id}' for tile_i, trial_id in enumerate(index)))
+	with open(output_dir / 'flagged.txt', 'w') as file:
+		file.write('\n'.join(f'{trial_id}\t{proportion:.3f}' for trial_id, proportion in sorted(flagged.items(), key=lambda item: item[1], reverse=True)))
+	return flagged
+
+
+if __name__ == '__main__':
+
+	import argparse
+	import eyekit
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--methods', action='store', nargs='+', default=core.algorithms, help='outputs to compare (the first is used to color the fixations)')
+	parser.add_argument('--data', action='store', type=str, default='sample', help='dataset in data/fixations to preview')
+	parser.add_argument('--output_dir', action='store', type=str, default=str(core.VISUALS / 'previews'), help='directory to write the contact sheets to')
+	parser.add_argument('--tiles_per_sheet', action='store', type=int, default=100, help='number of trials per contact sheet')
+	parser.add_argument('--n_cols', action='store', type=int, default=10, help='number of columns in each contact sheet')
+	parser.add_argument('--scale', action='store', type=float, default=0.125, help='preview pixels per screen pixel')
+	parser.add_argument('--threshold', action='store', type=float, default=0.0, help='flag trials whose proportion of disagreements exceeds this')
+	args = parser.parse_args()
+
+	passages = eyekit.io.read(core.DATA / 'passages.json')
+	sample_data = eyekit.io.read(core.FIXATIONS / f'{args.data}.json')
+	outputs = {method:eyekit.io.read(core.FIXATIONS / f'{method}.json') for method in args.methods}
+
+	flagged = make_contact_sheets(sample_data, passages, outputs, Path(args.output_dir), args.tiles_per_sheet, args.n_cols, args.scale, args.threshold)
+	print('%i of %i trials flagged' % (len(flagged), len(sample_data)))
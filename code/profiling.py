@@ -0,0 +1,119 @@
+'''
+Opt-in instrumentation of the drift algorithms. While a Profiler is
+enabled, every call to algorithms.correct_drift is timed and recorded
+along with the input sizes and the work counters incremented inside the
+algorithms (DTW cells filled, merge candidate pairs evaluated, optimizer
+function evaluations, and KMeans fits). When no Profiler is enabled, the
+counting hooks reduce to a single None check.
+'''
+
+import json
+from time import perf_counter
+
+
+active = None
+
+
+def count(counter, amount=1):
+	'''
+	Increment a work counter on the active profiler, if there is one.
+	'''
+	if active is not None:
+		active.count(counter, amount)
+
+def label(**labels):
+	'''
+	Attach labels (e.g. trial ID or factor value) to all subsequent
+	records of the active profiler, if there is one.
+	'''
+	if active is not None:
+		active.labels.update(labels)
+
+
+class Profiler:
+
+	def __init__(self, **labels):
+		self.labels = labels
+		self.records = []
+		self._counters = None
+
+	def __enter__(self):
+		self.enable()
+		return self
+
+	def __exit__(self, *exc_info):
+		self.disable()
+
+	def enable(self):
+		global active
+		active = self
+
+	def disable(self):
+		global active
+		if active is self:
+			active = None
+
+	def count(self, counter, amount=1):
+		if self._counters is not None:
+			self._counters[counter] = self._counters.get(counter, 0) + amount
+
+	def measure(self, method, function, *args, n_words=None, **kwargs):
+		'''
+		Call function(*args, **kwargs) and record its wall time, input
+		sizes, and work counters under the given method name.
+		'''
+		self._counters = {}
+		start_time = perf_counter()
+		output = function(*args, **kwargs)
+		wall_time = perf_counter() - start_time
+		record = {'method':method, 'n_fixations':len(args[0]), 'n_lines':len(args[1]), 'n_words':n_words, 'wall_time':wall_time, 'counters':self._counters}
+		record.update(self.labels)
+		self.records.append(record)
+		self._counters = None
+		return output
+
+	def write(self, file_path, append=True):
+		'''
+		Write the records to a JSON lines file.
+		'''
+		with open(file_path, mode='a' if append else 'w', encoding='utf-8') as file:
+			for record in self.records:
+				file.write(json.dumps(record) + '\n')
+
+
+def read_records(file_path):
+	with open(file_path, encoding='utf-8') as file:
+		return [json.loads(line) for line in file if line.strip()]
+
+def summarize(records, key='method'):
+	'''
+	Aggregate records by some key, returning, for each value of the key,
+	the number of calls, the total and mean wall time, and the total of
+	each work counter.
+	'''
+	summary = {}
+	for record in records:
+		group = summary.setdefault(record[key], {'n_calls':0, 'total_time':0.0, 'counters':{}})
+		group['n_calls'] += 1
+		group['total_time'] += record['wall_time']
+		for counter, amount in record['counters'].items():
+			group['counters'][counter] = group['counters'].get(counter, 0) + amount
+	for group in summary.values():
+		group['mean_time'] = group['total_time'] / group['n_calls']
+	return summary
+
+def print_summary(summary):
+	for name, group in summary.items():
+		counters = ', '.join(f'{counter}={amount}' for counter, amount in sorted(group['counters'].items()))
+		print(f"{name:<12} {group['n_calls']:>6} calls  {group['total_time']:>10.3f}s total  {group['mean_time']*1000:>10.3f}ms mean  {counters}")
+
+
+if __name__ == '__main__':
+
+	import argparse
+	parser = argparse.ArgumentParser()
+	parser.add_argument('records', action='store', type=str, help='JSON lines file of profiling records')
+	parser.add_argument('--key', action='store', type=str, default='method', help='field to aggregate by')
+	args = parser.parse_args()
+
+	print_summary(summarize(read_records(args.records), args.key))
@@ -5,13 +5,14 @@ manual and algorithmic corrections.
 
 import eyekit
 import core
+import rendering
 
 eyekit.vis.set_default_font('Helvetica Neue', 8)
 
 passages = eyekit.io.read(core.DATA / 'passages.json')
 datasets = {dataset : eyekit.io.read(core.FIXATIONS / f'{dataset}.json') for dataset in ['sample', 'gold']+core.algorithms}
 
-booklet = eyekit.vis.Booklet()
+booklet = rendering.StreamingBooklet(core.SUPPLEMENT / 'item2.pdf', height=227)
 
 for trial_id, trial in datasets['sample'].items():
 	print(trial_id)
@@ -20,22 +21,19 @@ for trial_id, trial in datasets['sample'].items():
 
 	fig = eyekit.vis.Figure(4, 3)
 
-	sample_image = eyekit.vis.Image(1920, 1080)
-	sample_image.draw_text_block(passages[trial['passage_id']], color='gray')
+	sample_image = rendering.text_block_image(passages[trial['passage_id']])
 	sample_image.draw_fixation_sequence(sample_fixation_sequence)
 	sample_image.set_caption(f'Participant {trial["participant_id"]}, passage {trial["passage_id"]} ({trial["age_group"]})')
 	fig.add_image(sample_image)
 
-	gold_image = eyekit.vis.Image(1920, 1080)
-	gold_image.draw_text_block(passages[trial['passage_id']], color='gray')
+	gold_image = rendering.text_block_image(passages[trial['passage_id']])
 	gold_image.draw_fixation_sequence(gold_fixation_sequence, show_discards=True)
 	gold_image.set_caption('Gold standard manual correction')
 	fig.add_image(gold_image)
 
 	for algorithm in core.algorithms:
 		data = datasets[algorithm]
-		image = eyekit.vis.Image(1920, 1080)
-		image.draw_text_block(passages[trial['passage_id']], color='gray')
+		image = rendering.text_block_image(passages[trial['passage_id']])
 		image.draw_sequence_comparison(gold_fixation_sequence, data[trial_id]['fixations'])
 		image.set_caption(algorithm, font_face='Menlo')
 		fig.add_image(image)
@@ -46,4 +44,4 @@ for trial_id, trial in datasets['sample'].items():
 
 	booklet.add_figure(fig)
 
-booklet.save(core.SUPPLEMENT / 'item2.pdf', height=227)
+booklet.close()
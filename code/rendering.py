@@ -0,0 +1,97 @@
+'''
+Shared code for rendering figures with eyekit. The same passages are drawn
+hundreds of times (once per panel), so the text-block layer of each
+passage is built once and cached, and every new image starts from a copy
+of it. The cached layer consists of exactly the components that
+Image.draw_text_block would add, so the rendered files are unchanged.
+Pages that are saved to separate files can be rendered on a pool of
+processes, each of which keeps its own cache, and booklets can be
+streamed to disk one page at a time.
+'''
+
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import eyekit
+
+
+_text_block_layers = {}
+
+def text_block_image(passage, color='gray', screen_width=1920, screen_height=1080):
+	'''
+	Return a new eyekit Image with the passage already drawn on it, as if
+	by image.draw_text_block(passage, color=color).
+	'''
+	key = (id(passage), color, screen_width, screen_height)
+	if key not in _text_block_layers:
+		image = eyekit.vis.Image(screen_width, screen_height)
+		image.draw_text_block(passage, color=color)
+		# The passage is kept in the cache so that its id can't be reused
+		_text_block_layers[key] = (passage, tuple(image._block_extents), tuple(image._components))
+	_, block_extents, components = _text_block_layers[key]
+	image = eyekit.vis.Image(screen_width, screen_height)
+	image._block_extents = list(block_extents)
+	image._components = list(components)
+	return image
+
+def render_in_parallel(render, jobs, n_processes=None):
+	'''
+	Call a rendering function on each job using a pool of processes. The
+	function must be defined at the top level of a module.
+	'''
+	with ProcessPoolExecutor(n_processes) as executor:
+		for _ in executor.map(render, jobs, chunksize=8):
+			pass
+
+
+class StreamingBooklet:
+	'''
+	A drop-in for eyekit.vis.Booklet that renders each figure to the PDF
+	as soon as it is added, so that figures don't accumulate in memory.
+	If pages_per_file is set, the booklet is split into several files,
+	numbered from 1 (e.g. item2_1.pdf, item2_2.pdf, ...). Otherwise the
+	output is the same as Booklet.save(output_path, width, height).
+	'''
+
+	def __init__(self, output_path, width=210, height=297, pages_per_file=None):
+		self.output_path = Path(output_path)
+		self.page_width = eyekit.vis._mm_to_pts(width)
+		self.page_height = eyekit.vis._mm_to_pts(height)
+		self.pages_per_file = pages_per_file
+		self.file_paths = []
+		self._surface = None
+		self._n_pages = 0
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc_info):
+		self.close()
+
+	def _open(self):
+		if self.pages_per_file is None:
+			file_path = self.output_path
+		else:
+			file_path = self.output_path.with_name(f'{self.output_path.stem}_{len(self.file_paths) + 1}{self.output_path.suffix}')
+		self._surface = eyekit.vis._cairo.PDFSurface(str(file_path), self.page_width, self.page_height)
+		self._surface.set_metadata(eyekit.vis._cairo.PDF_METADATA_CREATOR, f'eyekit {eyekit.vis.__version__}')
+		self._context = eyekit.vis._cairo.Context(self._surface)
+		self._n_pages = 0
+		self.file_paths.append(file_path)
+
+	def add_figure(self, figure):
+		if self._surface is None:
+			self._open()
+		figure._render_to_booklet(self._surface, self._context, self.page_width)
+		self._surface.show_page()
+		self._n_pages += 1
+		if self.pages_per_file is not None and self._n_pages == self.pages_per_file:
+			self._finish()
+
+	def _finish(self):
+		self._surface.finish()
+		self._surface = None
+		self._context = None
+
+	def close(self):
+		if self._surface is not None:
+			self._finish()
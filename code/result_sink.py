@@ -0,0 +1,112 @@
+'''
+Streaming aggregation of simulation results. Rather than keeping every
+accuracy score in a dense (algorithms, gradations, sims) array, the sink
+updates running summary statistics as each result comes in, so memory
+does not grow with the number of simulations: the mean and variance are
+computed with Welford's algorithm, and quantiles are read off a
+fixed-resolution histogram (accuracy is always between 0 and 1).
+
+Optionally, the per-fixation error mask of every simulation (i.e.
+corrected_I != intended_I) can also be logged. The masks are bit-packed
+into a single ragged byte buffer with an index of offsets, so they can
+be analyzed later without rerunning the simulations.
+'''
+
+import numpy as np
+from scipy.stats import norm
+
+
+def conservative_interval_width(mean, sum_of_squares, count, confidence=0.95):
+	'''
+	Width of the (normal approximation) confidence interval around a mean
+	accuracy, given the sum of squared deviations from the mean over count
+	simulations. The sample variance is pooled with one pseudo-simulation
+	of the largest variance that an accuracy with this mean could have
+	(that of a Bernoulli variable at the Agresti-Coull adjusted mean), so
+	that a run of identical results, such as an algorithm that happens
+	not to fail in its first few simulations, does not give a width of 0.
+	'''
+	z = norm.ppf(0.5 + confidence / 2)
+	adjusted_mean = (mean * count + z**2 / 2) / (count + z**2)
+	variance = (sum_of_squares + adjusted_mean * (1 - adjusted_mean)) / count
+	return 2 * z * np.sqrt(variance / count)
+
+
+class ResultSink:
+
+	def __init__(self, n_algorithms, n_gradations, log_errors=False, n_bins=1000):
+		self.n_bins = n_bins
+		self.count = np.zeros((n_algorithms, n_gradations), dtype=np.int64)
+		self.mean = np.zeros((n_algorithms, n_gradations), dtype=float)
+		self.m2 = np.zeros((n_algorithms, n_gradations), dtype=float)
+		self.histogram = np.zeros((n_algorithms, n_gradations, n_bins), dtype=np.int64)
+		self.log_errors = log_errors
+		self.error_bits = bytearray()
+		self.error_index = [] # (algorithm, gradation, sim, n_fixations, offset)
+
+	def add(self, algorithm_i, gradation_i, matches):
+		'''
+		Add the result of one simulation, given the boolean array of
+		fixations that were assigned to the correct line.
+		'''
+		accuracy = matches.sum() / len(matches)
+		sim_i = self.count[algorithm_i, gradation_i]
+		self.count[algorithm_i, gradation_i] += 1
+		delta = accuracy - self.mean[algorithm_i, gradation_i]
+		self.mean[algorithm_i, gradation_i] += delta / self.count[algorithm_i, gradation_i]
+		self.m2[algorithm_i, gradation_i] += delta * (accuracy - self.mean[algorithm_i, gradation_i])
+		bin_i = min(int(accuracy * self.n_bins), self.n_bins - 1)
+		self.histogram[algorithm_i, gradation_i, bin_i] += 1
+		if self.log_errors:
+			self.error_index.append((algorithm_i, gradation_i, sim_i, len(matches), len(self.error_bits)))
+			self.error_bits.extend(np.packbits(~matches).tobytes())
+		return accuracy
+
+	@property
+	def variance(self):
+		with np.errstate(invalid='ignore', divide='ignore'):
+			return self.m2 / (self.count - 1)
+
+	def interval_width(self, gradation_i, confidence=0.95):
+		'''
+		Width of the confidence interval around the mean accuracy of each
+		algorithm at a given gradation (see conservative_interval_width).
+		'''
+		return conservative_interval_width(self.mean[:, gradation_i], self.m2[:, gradation_i], self.count[:, gradation_i], confidence)
+
+	def quantile(self, q):
+		'''
+		Approximate q-th quantile of accuracy for every algorithm and
+		gradation (accurate to the histogram's bin width).
+		'''
+		cumulative = self.histogram.cumsum(axis=2)
+		targets = q * self.count[:, :, np.newaxis]
+		bin_I = (cumulative < targets).sum(axis=2)
+		return (np.minimum(bin_I, self.n_bins - 1) + 0.5) / self.n_bins
+
+	def errors(self, algorithm_i, gradation_i, sim_i):
+		'''
+		Returns the boolean error mask for a given simulation.
+		'''
+		for entry in self.error_index:
+			if entry[:3] == (algorithm_i, gradation_i, sim_i):
+				n_fixations, offset = entry[3:]
+				n_bytes = (n_fixations + 7) // 8
+				packed = np.frombuffer(self.error_bits, dtype=np.uint8, count=n_bytes, offset=offset)
+				return np.unpackbits(packed, count=n_fixations).astype(bool)
+		raise KeyError('No error mask logged for this simulation')
+
+	def save(self, file_path):
+		np.savez_compressed(file_path, count=self.count, mean=self.mean, m2=self.m2, histogram=self.histogram,
+			error_bits=np.frombuffer(bytes(self.error_bits), dtype=np.uint8),
+			error_index=np.array(self.error_index, dtype=np.int64).reshape(-1, 5))
+
+	@classmethod
+	def load(cls, file_path):
+		with np.load(file_path) as data:
+			n_algorithms, n_gradations, n_bins = data['histogram'].shape
+			sink = cls(n_algorithms, n_gradations, log_errors=len(data['error_index']) > 0, n_bins=n_bins)
+			sink.count, sink.mean, sink.m2, sink.histogram = data['count'], data['mean'], data['m2'], data['histogram']
+			sink.error_bits = bytearray(data['error_bits'].tobytes())
+			sink.error_index = [tuple(int(value) for value in entry) for entry in data['error_index']]
+		return sink
@@ -0,0 +1,140 @@
+'''
+Compressed, lazily loaded storage for simulation results. A result store
+is a single file holding a (algorithm, factor value, sim) array along
+with its named axes and metadata (seed, code version, parameters). The
+file consists of a short JSON header followed by the array, split into
+one zlib-compressed chunk per algorithm and gradation. The file is
+memory mapped, so selecting a single algorithm or gradation only reads
+and decompresses the bytes of the relevant chunks.
+
+Existing pickled results can be migrated with:
+
+	python result_store.py ../data/simulations/*.pkl
+'''
+
+import json
+import mmap
+import struct
+import subprocess
+import zlib
+from pathlib import Path
+import numpy as np
+import core
+
+
+MAGIC = b'DRIFTRES'
+
+
+def code_version():
+	try:
+		return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=core.ROOT, capture_output=True, text=True, check=True).stdout.strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+
+class ResultStore:
+
+	def __init__(self, file_path):
+		self.file_path = Path(file_path)
+		with open(self.file_path, mode='rb') as file:
+			self._buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+		if self._buffer[:len(MAGIC)] != MAGIC:
+			raise ValueError(f'{file_path} is not a result store')
+		header_length, = struct.unpack('<Q', self._buffer[len(MAGIC):len(MAGIC)+8])
+		header_start = len(MAGIC) + 8
+		self.header = json.loads(self._buffer[header_start:header_start+header_length].decode('utf-8'))
+		self._data_start = header_start + header_length
+		self.algorithms = self.header['axes']['algorithm']
+		self.factor_values = np.array(self.header['axes']['factor_value'])
+		self.n_sims = self.header['axes']['sim']
+		self.metadata = self.header['metadata']
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc_info):
+		self.close()
+
+	@property
+	def shape(self):
+		return (len(self.algorithms), len(self.factor_values), self.n_sims)
+
+	def _read_chunk(self, algorithm_i, gradation_i):
+		offset, length = self.header['chunks'][algorithm_i][gradation_i]
+		start = self._data_start + offset
+		chunk = zlib.decompress(self._buffer[start:start+length])
+		return np.frombuffer(chunk, dtype=self.header['dtype'])
+
+	def select(self, algorithm=None, gradation=None):
+		'''
+		Read the results for one algorithm (by name) and/or one gradation
+		(by index); if either is None, all are read. The returned array
+		drops any axis that was selected on.
+		'''
+		algorithm_I = range(len(self.algorithms)) if algorithm is None else [self.algorithms.index(algorithm)]
+		gradation_I = range(len(self.factor_values)) if gradation is None else [gradation]
+		results = np.array([[self._read_chunk(a, g) for g in gradation_I] for a in algorithm_I])
+		if gradation is not None:
+			results = results[:, 0]
+		if algorithm is not None:
+			results = results[0]
+		return results
+
+	def close(self):
+		self._buffer.close()
+
+	@staticmethod
+	def write(file_path, results, factor_values, algorithms=None, **metadata):
+		'''
+		Write a (algorithm, factor value, sim) results array to a result
+		store. The code version is added to the metadata automatically.
+		'''
+		if algorithms is None:
+			algorithms = core.algorithms
+		results = np.ascontiguousarray(results)
+		metadata.setdefault('code_version', code_version())
+		chunks, offsets, position = [], [], 0
+		for algorithm_i in range(results.shape[0]):
+			offsets.append([])
+			for gradation_i in range(results.shape[1]):
+				chunk = zlib.compress(results[algorithm_i, gradation_i].tobytes())
+				offsets[-1].append((position, len(chunk)))
+				chunks.append(chunk)
+				position += len(chunk)
+		header = {'dtype':results.dtype.str, 'axes':{'algorithm':list(algorithms), 'factor_value':[float(value) for value in factor_values], 'sim':results.shape[2]}, 'metadata':metadata, 'chunks':offsets}
+		header = json.dumps(header).encode('utf-8')
+		with open(file_path, mode='wb') as file:
+			file.write(MAGIC)
+			file.write(struct.pack('<Q', len(header)))
+			file.write(header)
+			for chunk in chunks:
+				file.write(chunk)
+
+
+def convert_pickle(pickle_path, store_path=None):
+	'''
+	Migrate a pickled results array created by simulation.py into a
+	result store next to it (or at the given path).
+	'''
+	import pickle
+	pickle_path = Path(pickle_path)
+	factor = pickle_path.stem
+	if store_path is None:
+		store_path = pickle_path.with_suffix('.res')
+	with open(pickle_path, mode='rb') as file:
+		results = pickle.load(file)
+	_, (factor_min, factor_max) = core.factors[factor]
+	factor_values = np.linspace(factor_min, factor_max, results.shape[1])
+	ResultStore.write(store_path, results, factor_values, factor=factor, seed=None, params={'n_gradations':results.shape[1], 'n_sims':results.shape[2]}, converted_from=pickle_path.name, code_version=None)
+	return store_path
+
+
+if __name__ == '__main__':
+
+	import argparse
+	parser = argparse.ArgumentParser()
+	parser.add_argument('pickles', action='store', nargs='+', type=str, help='pickled results to convert')
+	args = parser.parse_args()
+
+	for pickle_path in args.pickles:
+		print(pickle_path, '->', convert_pickle(pickle_path))
@@ -2,30 +2,302 @@
 Code for running the algorithms over the sample data
 '''
 
+from concurrent.futures import ProcessPoolExecutor
+import asyncio
+import hashlib
+import inspect
+import json
+import os
+import re
 import eyekit
+import numpy as np
 import algorithms
 import core
+import drift_priors
+import profiling
 
 
-def run_algorithm(sample_data, passages, output_dir, method):
+def make_trial(trial, corrected_Y):
+    new_trial = {'participant_id':trial['participant_id'], 'age_group':trial['age_group'], 'passage_id':trial['passage_id'], 'fixations':[]}
+    for fixation, y in zip(trial['fixations'], corrected_Y):
+        new_trial['fixations'].append((fixation.x, int(y), fixation.start, fixation.end, fixation.discarded))
+    new_trial['fixations'] = eyekit.FixationSequence(new_trial['fixations'])
+    return new_trial
+
+def run_algorithm(sample_data, passages, output_dir, method, priors=None):
     print(method.upper())
     output_data = {}
+    params = {}
     for trial_id, trial in sample_data.items():
         print('-', trial_id)
-        new_trial = {'participant_id':trial['participant_id'], 'age_group':trial['age_group'], 'passage_id':trial['passage_id'], 'fixations':[]}
+        profiling.label(trial_id=trial_id)
+        if priors is not None and 'prior' in algorithms.registry[method]['defaults']:
+            params['prior'] = priors.prior(trial['participant_id'], trial.get('session'))
         fixation_XY = [fixation.xy for fixation in trial['fixations']]
-        correction = algorithms.correct_drift(method, fixation_XY, passages[trial['passage_id']])
-        for fixation, (_, y) in zip(trial['fixations'], correction):
-            new_trial['fixations'].append((fixation.x, int(y), fixation.start, fixation.end, fixation.discarded))
-        new_trial['fixations'] = eyekit.FixationSequence(new_trial['fixations'])
-        output_data[trial_id] = new_trial
+        correction = algorithms.correct_drift(method, fixation_XY, passages[trial['passage_id']], **params)
+        output_data[trial_id] = make_trial(trial, correction[:, 1])
     eyekit.io.write(output_data, output_dir / f'{method}.json', compress=True)
 
 
+def algorithms_version():
+    '''
+    Hash of the source code of the algorithms module, so that cached
+    outputs are invalidated when an algorithm changes, including any
+    module-level data it reads (such as merge's phases). Hashing the whole
+    module invalidates more than strictly necessary, but unlike tracking
+    each method's dependencies, it can't miss one.
+    '''
+    return hashlib.sha256(inspect.getsource(algorithms).encode('utf-8')).hexdigest()
+
+def job_key(method, fixation_XY, passage_id, params, version):
+    '''
+    Content hash identifying the output of a method on a trial.
+    '''
+    content = hashlib.sha256(np.array(fixation_XY, dtype=int).tobytes())
+    content.update(json.dumps([method, passage_id, params, version], sort_keys=True).encode('utf-8'))
+    return content.hexdigest()
+
+def init_worker():
+    global worker_passages
+    worker_passages = eyekit.io.read(core.DATA / 'passages.json')
+
+def correct_trial(method, fixation_XY, passage_id, params):
+    '''
+    Returns the corrected y-values and whether the method ran out of its
+    time or evaluation budget.
+    '''
+    correction, truncated = algorithms.correct_drift(method, fixation_XY, worker_passages[passage_id], return_truncated=True, **params)
+    return [int(y) for y in correction[:, 1]], truncated
+
+def run_algorithms(sample_data, output_dir, methods, params=None, n_processes=None, cache_dir=None):
+    '''
+    Run each method over every trial using a pool of processes, starting
+    with the jobs that are expected to take longest. The output of each
+    (method, trial) job is cached under a hash of the fixations, passage
+    ID, method, parameters, and algorithm version, so only jobs whose
+    inputs or algorithm changed are recomputed on later runs. Outputs
+    that were cut short by a time or evaluation budget depend on timing,
+    so they are not cached.
+    '''
+    if params is None:
+        params = {}
+    if cache_dir is None:
+        cache_dir = core.DATA / 'cache'
+    cache_dir.mkdir(exist_ok=True)
+    outputs, jobs = {method:{} for method in methods}, []
+    version = algorithms_version()
+    for method in methods:
+        method_params = params.get(method, {})
+        for trial_id, trial in sample_data.items():
+            fixation_XY = [fixation.xy for fixation in trial['fixations']]
+            key = job_key(method, fixation_XY, trial['passage_id'], method_params, version)
+            cache_path = cache_dir / f'{key}.json'
+            if cache_path.exists():
+                with open(cache_path) as file:
+                    outputs[method][trial_id] = json.load(file)
+            else:
+                jobs.append((algorithms.estimated_cost(method, len(fixation_XY), method_params), method, trial_id, fixation_XY, trial['passage_id'], method_params, cache_path))
+    jobs.sort(key=lambda job: job[0], reverse=True)
+    print('%i jobs to run, %i cached' % (len(jobs), len(methods) * len(sample_data) - len(jobs)))
+    with ProcessPoolExecutor(n_processes, initializer=init_worker) as executor:
+        futures = []
+        for _, method, trial_id, fixation_XY, passage_id, method_params, cache_path in jobs:
+            future = executor.submit(correct_trial, method, fixation_XY, passage_id, method_params)
+            futures.append((method, trial_id, cache_path, future))
+        for method, trial_id, cache_path, future in futures:
+            outputs[method][trial_id], truncated = future.result()
+            if truncated:
+                print('-', method, trial_id, '(truncated)')
+                continue
+            with open(cache_path, 'w') as file:
+                json.dump(outputs[method][trial_id], file)
+            print('-', method, trial_id)
+    for method in methods:
+        output_data = {trial_id:make_trial(trial, outputs[method][trial_id]) for trial_id, trial in sample_data.items()}
+        eyekit.io.write(output_data, output_dir / f'{method}.json', compress=True)
+
+
+def eyekit_json_decoder():
+    '''
+    JSON decoder that reconstructs eyekit objects (fixation sequences and
+    text blocks) as eyekit.io.read does. eyekit does not expose its object
+    hook publicly, so this is the only place that relies on it.
+    '''
+    return json.JSONDecoder(object_hook=eyekit.io._eyekit_decoder)
+
+def iter_trials(file_path, chunk_size=2**20):
+    '''
+    Decode the trials in an eyekit JSON file one at a time, yielding
+    (trial_id, trial) pairs. The file is read in chunks into a buffer from
+    which decoded text is dropped, so only about one chunk of raw text and
+    the trials currently in flight are held in memory.
+    '''
+    decoder = eyekit_json_decoder()
+    whitespace = re.compile(r'[ \t\n\r]*')
+    with open(file_path, encoding='utf-8') as file:
+        buffer, position = '', 0
+
+        def read_more():
+            nonlocal buffer, position
+            chunk = file.read(chunk_size)
+            buffer, position = buffer[position:] + chunk, 0
+            return bool(chunk)
+
+        def next_character():
+            nonlocal position
+            while True:
+                position = whitespace.match(buffer, position).end()
+                if position < len(buffer):
+                    return buffer[position]
+                if not read_more():
+                    raise ValueError(f'Unexpected end of file in {file_path}')
+
+        def decode():
+            nonlocal position
+            next_character()
+            while True:
+                try:
+                    value, position = decoder.raw_decode(buffer, position)
+                    return value
+                except json.JSONDecodeError:
+                    if not read_more(): # the value may continue in the next chunk
+                        raise
+
+        if next_character() != '{':
+            raise ValueError(f'{file_path} does not contain a JSON object')
+        position += 1
+        while next_character() != '}':
+            trial_id = decode()
+            if next_character() != ':':
+                raise ValueError(f'Expected a colon after {trial_id} in {file_path}')
+            position += 1
+            trial = decode()
+            yield trial_id, trial
+            if next_character() == ',':
+                position += 1
+
+class TrialWriter:
+    '''
+    Write trials to an eyekit JSON file one at a time. The output is
+    identical to eyekit.io.write(data, file_path, compress=True).
+    '''
+
+    def __init__(self, file_path):
+        self.file = open(file_path, 'w', encoding='utf-8')
+        self.file.write('{')
+        self.n_trials = 0
+
+    def write(self, trial_id, trial):
+        if self.n_trials:
+            self.file.write(',')
+        self.file.write(json.dumps(trial_id, ensure_ascii=False) + ':')
+        self.file.write(json.dumps(trial, default=eyekit.io._eyekit_encoder, ensure_ascii=False, separators=(',', ':')))
+        self.n_trials += 1
+
+    def close(self):
+        self.file.write('}')
+        self.file.close()
+
+async def stream_algorithm(input_path, output_path, method, executor, params=None, max_in_flight=64, n_workers=8):
+    '''
+    Correct the trials in one file with one method as a streaming
+    pipeline: trials are decoded as they are read, corrected on the
+    executor, and written to the output in their original order. At most
+    max_in_flight trials are held in memory at any one time.
+    '''
+    loop = asyncio.get_running_loop()
+    params = params or {}
+    in_flight = asyncio.Semaphore(max_in_flight)
+    trial_queue = asyncio.Queue(n_workers)
+    completed, completed_event = {}, asyncio.Event()
+    truncated_trial_ids = []
+
+    async def read():
+        trials = iter_trials(input_path)
+        trial_i = 0
+        while True:
+            await in_flight.acquire()
+            item = await loop.run_in_executor(None, next, trials, None)
+            if item is None:
+                break
+            await trial_queue.put((trial_i, *item))
+            trial_i += 1
+        for _ in range(n_workers):
+            await trial_queue.put(None)
+        return trial_i
+
+    async def correct():
+        while (item := await trial_queue.get()) is not None:
+            trial_i, trial_id, trial = item
+            fixation_XY = [fixation.xy for fixation in trial['fixations']]
+            corrected_Y, truncated = await loop.run_in_executor(executor, correct_trial, method, fixation_XY, trial['passage_id'], params)
+            if truncated:
+                truncated_trial_ids.append(trial_id)
+            completed[trial_i] = (trial_id, make_trial(trial, corrected_Y))
+            completed_event.set()
+
+    async def write(n_trials):
+        writer = TrialWriter(output_path)
+        trial_i = 0
+        while not (n_trials.done() and trial_i == n_trials.result()):
+            if trial_i not in completed:
+                completed_event.clear()
+                await completed_event.wait()
+                continue
+            trial_id, trial = completed.pop(trial_i)
+            await loop.run_in_executor(None, writer.write, trial_id, trial)
+            in_flight.release()
+            trial_i += 1
+        writer.close()
+
+    n_trials = asyncio.ensure_future(read())
+    n_trials.add_done_callback(lambda _: completed_event.set())
+    workers = [asyncio.ensure_future(correct()) for _ in range(n_workers)]
+    await asyncio.gather(n_trials, *workers, write(n_trials))
+    if truncated_trial_ids:
+        print('%i trials truncated: %s' % (len(truncated_trial_ids), ', '.join(truncated_trial_ids)))
+
+def stream_algorithms(input_path, output_dir, methods, params=None, n_processes=None, max_in_flight=64):
+    '''
+    Run each method over every trial in a file using the streaming
+    pipeline, sharing one pool of worker processes between methods.
+    '''
+    if params is None:
+        params = {}
+    with ProcessPoolExecutor(n_processes, initializer=init_worker) as executor:
+        for method in methods:
+            print(method.upper())
+            asyncio.run(stream_algorithm(input_path, output_dir / f'{method}.json', method, executor, params.get(method), max_in_flight, 2 * (n_processes or os.cpu_count())))
+
+
 if __name__ == '__main__':
 
-    sample_data = eyekit.io.read(core.FIXATIONS / 'sample.json')
-    passages = eyekit.io.read(core.DATA / 'passages.json')
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--profile', action='store', type=str, default=None, help='JSON lines file to write profiling records to (runs serially)')
+    parser.add_argument('--methods', action='store', nargs='+', default=core.algorithms, help='algorithms to run')
+    parser.add_argument('--n_processes', action='store', type=int, default=None, help='number of worker processes')
+    parser.add_argument('--stream', action='store_true', help='stream trials through the algorithms with bounded memory (no caching)')
+    parser.add_argument('--priors', action='store', type=str, default=None, help='JSON file of per-participant drift priors to warm start regress and stretch (runs serially)')
+    args = parser.parse_args()
 
-    for method in core.algorithms:
-        run_algorithm(sample_data, passages, core.FIXATIONS, method)
+    if args.stream:
+        stream_algorithms(core.FIXATIONS / 'sample.json', core.FIXATIONS, args.methods, n_processes=args.n_processes)
+    elif args.profile or args.priors:
+        sample_data = eyekit.io.read(core.FIXATIONS / 'sample.json')
+        passages = eyekit.io.read(core.DATA / 'passages.json')
+        priors = drift_priors.DriftPriors(args.priors) if args.priors else None
+        profiler = profiling.Profiler()
+        if args.profile:
+            profiler.enable()
+        for method in args.methods:
+            run_algorithm(sample_data, passages, core.FIXATIONS, method, priors)
+        if args.profile:
+            profiler.disable()
+            profiler.write(args.profile)
+            profiling.print_summary(profiling.summarize(profiler.records))
+        if priors is not None:
+            priors.save()
+    else:
+        sample_data = eyekit.io.read(core.FIXATIONS / 'sample.json')
+        run_algorithms(sample_data, core.FIXATIONS, args.methods, n_processes=args.n_processes)
@@ -0,0 +1,95 @@
+'''
+Code for correcting long recordings that span several pages or screens.
+The algorithms assume one passage per call and most of them scale
+super-linearly with the number of fixations (merge is roughly cubic and
+warp is O(nw)), so a session is split into chunks, one per page, at the
+given page boundaries or, failing that, at long upward vertical resets
+(the eye returning to the top of a screen). Given page boundaries may be
+off by a few fixations (e.g. page turns logged with some lag), so each
+boundary is moved to the longest upward reset within a small overlap
+window either side of it, where the eye actually moved to the new page.
+The chunks are then corrected independently and in parallel (each chunk
+is a different page, so no context is shared across a boundary) and
+stitched back into one continuous vector of line assignments for the
+whole session.
+
+Lines are numbered continuously across the session's passages, so that
+line i of passage k is given the number i plus the number of lines in
+passages 0 to k-1.
+'''
+
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import algorithms
+
+
+def detect_resets(fixation_XY, reset_thresh):
+	'''
+	Indices of the fixations that follow an upward jump of more than
+	reset_thresh pixels.
+	'''
+	return [int(i) for i in np.where(np.diff(fixation_XY[:, 1]) < -reset_thresh)[0] + 1]
+
+def make_chunks(fixation_XY, passages, page_starts=None, reset_thresh=None):
+	'''
+	Split a session into (start, end, passage_i) chunks. page_starts, if
+	given, are the indices of the first fixation on each page, starting
+	with 0. If page_starts is not given, the session is split at resets of more than
+	reset_thresh pixels (by default, half the height of the first
+	passage), and the chunks are matched to the passages in order, or
+	all to the same passage if only one is given.
+	'''
+	n = len(fixation_XY)
+	if page_starts is None:
+		if reset_thresh is None:
+			reset_thresh = (passages[0].midlines[-1] - passages[0].midlines[0]) / 2
+		page_starts = [0] + detect_resets(fixation_XY, reset_thresh)
+	elif len(page_starts) == 0 or page_starts[0] != 0:
+		raise ValueError('page_starts must begin with 0, the start of the first page')
+	page_ends = list(page_starts[1:]) + [n]
+	if len(passages) == 1:
+		passage_I = [0] * len(page_starts)
+	elif len(passages) == len(page_starts):
+		passage_I = list(range(len(passages)))
+	else:
+		raise ValueError(f'Found {len(page_starts)} pages but {len(passages)} passages were given')
+	return [(start, end, passage_i) for start, end, passage_i in zip(page_starts, page_ends, passage_I) if end > start]
+
+def resolve_boundaries(fixation_XY, chunks, overlap):
+	'''
+	Move each boundary between chunks by up to overlap fixations to the
+	longest upward reset in that window, if it is longer than the one at
+	the boundary itself.
+	'''
+	chunks = [list(chunk) for chunk in chunks]
+	diff_Y = np.diff(fixation_XY[:, 1]) # diff_Y[i-1] is the jump onto fixation i
+	for left, right in zip(chunks[:-1], chunks[1:]):
+		boundary = left[1]
+		window_start, window_end = max(left[0] + 1, boundary - overlap), min(right[1] - 1, boundary + overlap)
+		best_split = window_start + int(np.argmin(diff_Y[window_start-1:window_end]))
+		if diff_Y[best_split-1] < min(0, diff_Y[boundary-1]):
+			left[1] = right[0] = best_split
+	return [tuple(chunk) for chunk in chunks]
+
+def correct_chunk(method, fixation_XY, passage, params):
+	corrected_XY = algorithms.correct_drift(method, fixation_XY, passage, **params)
+	line_Y = np.array(passage.midlines, dtype=int)
+	return np.argmin(abs(line_Y[np.newaxis, :] - corrected_XY[:, 1:2]), axis=1)
+
+def correct_session(method, fixation_XY, passages, page_starts=None, reset_thresh=None, overlap=5, n_processes=None, **params):
+	'''
+	Correct a session of one or more pages in parallel chunks and return
+	one line assignment per fixation, numbered continuously across the
+	passages. overlap is the number of fixations either side of each page
+	boundary that it may be moved by.
+	'''
+	fixation_XY = np.array(fixation_XY, dtype=int)
+	chunks = resolve_boundaries(fixation_XY, make_chunks(fixation_XY, passages, page_starts, reset_thresh), overlap)
+	line_offsets = np.cumsum([0] + [passage.n_rows for passage in passages])
+	chunks.sort(key=lambda chunk: algorithms.estimated_cost(method, chunk[1] - chunk[0], params), reverse=True)
+	line_assignments = np.zeros(len(fixation_XY), dtype=int)
+	with ProcessPoolExecutor(n_processes) as executor:
+		futures = [(chunk, executor.submit(correct_chunk, method, fixation_XY[chunk[0]:chunk[1]], passages[chunk[2]], params)) for chunk in chunks]
+		for (start, end, passage_i), future in futures:
+			line_assignments[start:end] = future.result() + line_offsets[passage_i]
+	return line_assignments
@@ -4,6 +4,8 @@ clustering analysis.
 '''
 
 import pickle
+from functools import lru_cache
+from time import perf_counter
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.transforms as transforms
@@ -108,29 +110,203 @@ class Dendrogram:
 		axis.set_yticks([])
 
 
-def algorithmic_output_distance(method1, method2):
+def coarsen(sequence):
+	'''
+	Halve the resolution of a sequence by averaging adjacent pairs.
+	'''
+	n_pairs = len(sequence) // 2
+	coarse = sequence[:2*n_pairs].reshape(n_pairs, 2, -1).mean(axis=1)
+	if len(sequence) % 2:
+		coarse = np.concatenate([coarse, sequence[-1:]])
+	return coarse
+
+def expand_window(path, n1, n2, radius):
+	'''
+	Project a warping path found at half resolution onto the full
+	resolution and widen it by some radius. The window is given as the
+	first and last column allowed in each row.
+	'''
+	first_J = np.full(n1, n2, dtype=int)
+	last_J = np.full(n1, -1, dtype=int)
+	for i, j in path:
+		rows = slice(max(0, 2*i-radius), min(n1, 2*i+2+radius))
+		first_J[rows] = np.minimum(first_J[rows], max(0, 2*j-radius))
+		last_J[rows] = np.maximum(last_J[rows], min(n2-1, 2*j+1+radius))
+	# Make the window monotonic so that it contains a connected path
+	first_J = np.minimum.accumulate(first_J[::-1])[::-1]
+	last_J = np.maximum.accumulate(last_J)
+	first_J[0], last_J[-1] = 0, n2 - 1
+	return first_J, last_J
+
+def windowed_dynamic_time_warping(sequence1, sequence2, first_J=None, last_J=None, abandon_above=None):
+	'''
+	Dynamic time warping restricted to a window of columns in each row
+	(the full matrix if no window is given), computing each row with
+	vectorized operations. If abandon_above is given and every cell in
+	some row exceeds it, the final cost must too, so the computation is
+	abandoned and the cost is returned as infinity (without a path).
+	Returns the cost and the warping path as a list of (i, j) pairs.
+	'''
+	n1 = len(sequence1)
+	n2 = len(sequence2)
+	if first_J is None:
+		first_J, last_J = np.zeros(n1, dtype=int), np.full(n1, n2-1, dtype=int)
+	rows = []
+	previous_row, previous_first_j = np.array([0.0]), -1 # virtual cell before (0, 0)
+	for i in range(n1):
+		first_j, last_j = first_J[i], last_J[i]
+		J = np.arange(first_j, last_j+1)
+		this_cost = np.sqrt(((sequence2[first_j:last_j+1] - sequence1[i])**2).sum(axis=1))
+		up = np.full(len(J), np.inf)
+		diagonal = np.full(len(J), np.inf)
+		previous_J = J - previous_first_j
+		in_previous = (previous_J >= 0) & (previous_J < len(previous_row))
+		up[in_previous] = previous_row[previous_J[in_previous]]
+		in_previous = (previous_J >= 1) & (previous_J <= len(previous_row))
+		diagonal[in_previous] = previous_row[previous_J[in_previous] - 1]
+		# row[j] = min(this_cost[j] + min(up[j], diagonal[j]), row[j-1] + this_cost[j])
+		# is solved for the whole row with a cumulative sum and minimum
+		cumulative_cost = np.cumsum(this_cost)
+		row = cumulative_cost + np.minimum.accumulate(np.minimum(up, diagonal) + this_cost - cumulative_cost)
+		if abandon_above is not None and row.min() > abandon_above:
+			return np.inf, None
+		rows.append(row)
+		previous_row, previous_first_j = row, first_j
+	path = [(n1-1, n2-1)]
+	i, j = n1 - 1, n2 - 1
+	def cell(i, j):
+		if 0 <= j - first_J[i] < len(rows[i]):
+			return rows[i][j - first_J[i]]
+		return np.inf
+	while i > 0 or j > 0:
+		possible_moves = [cell(i-1, j-1) if i > 0 and j > 0 else np.inf, cell(i-1, j) if i > 0 else np.inf, cell(i, j-1) if j > 0 else np.inf]
+		best_move = np.argmin(possible_moves)
+		if best_move == 0:
+			i -= 1
+			j -= 1
+		elif best_move == 1:
+			i -= 1
+		else:
+			j -= 1
+		path.append((i, j))
+	return rows[-1][-1], path[::-1]
+
+def fast_dynamic_time_warping(sequence1, sequence2, radius=1, abandon_above=None):
+	'''
+	Approximate dynamic time warping in linear time and space (FastDTW;
+	Salvador & Chan, 2007): the sequences are coarsened, warped
+	recursively, and the path is projected back onto the full resolution,
+	where DTW is only computed within radius cells of it. The cost is
+	never below the exact cost. Returns the cost and the warping path.
+	'''
+	sequence1 = np.asarray(sequence1, dtype=float)
+	sequence2 = np.asarray(sequence2, dtype=float)
+	if len(sequence1) <= radius + 2 or len(sequence2) <= radius + 2:
+		return windowed_dynamic_time_warping(sequence1, sequence2, abandon_above=abandon_above)
+	# The coarse cost is not a bound on the full-resolution cost, so the
+	# coarse levels are never abandoned
+	_, coarse_path = fast_dynamic_time_warping(coarsen(sequence1), coarsen(sequence2), radius)
+	first_J, last_J = expand_window(coarse_path, len(sequence1), len(sequence2), radius)
+	return windowed_dynamic_time_warping(sequence1, sequence2, first_J, last_J, abandon_above)
+
+@lru_cache(maxsize=None)
+def load_output(method):
+	'''
+	The non-discarded fixations in each trial of an algorithm's output.
+	'''
+	data = eyekit.io.read(core.FIXATIONS / f'{method}.json')
+	return {trial_id:np.array([f.xy for f in trial['fixations'] if not f.discarded], dtype=int) for trial_id, trial in data.items()}
+
+def algorithmic_output_distance(method1, method2, radius=None, abandon_above=None):
+	'''
+	Median DTW cost between two methods' outputs across the trials. If a
+	radius is given, the cost is approximated by FastDTW. If abandon_above
+	is given, the DTW of a trial is abandoned as soon as its cost must
+	exceed the threshold, and the whole comparison is abandoned once at
+	least half of the trials have been. The result is then exact if it is
+	at most abandon_above; otherwise, infinity is returned, meaning only
+	that the distance exceeds the threshold. Abandoning is therefore only
+	safe when distances above the threshold don't need to be known, as
+	when screening for near-duplicate methods; the MDS and clustering
+	analyses need every distance.
+	'''
 	from algorithms import dynamic_time_warping
-	data1 = eyekit.io.read(core.FIXATIONS / f'{method1}.json')
-	data2 = eyekit.io.read(core.FIXATIONS / f'{method2}.json')
+	output1 = load_output(method1)
+	output2 = load_output(method2)
 	results = []
-	for trial_id, trial in data1.items():
-		fixation_XY1 = np.array([f.xy for f in trial['fixations'] if not f.discarded], dtype=int)
-		fixation_XY2 = np.array([f.xy for f in data2[trial_id]['fixations'] if not f.discarded], dtype=int)
-		cost, _ = dynamic_time_warping(fixation_XY1, fixation_XY2)
+	n_abandoned, max_abandoned = 0, len(output1) - len(output1) // 2
+	for trial_id, fixation_XY1 in output1.items():
+		fixation_XY2 = output2[trial_id]
+		if radius is not None:
+			cost, _ = fast_dynamic_time_warping(fixation_XY1, fixation_XY2, radius, abandon_above)
+		elif abandon_above is not None:
+			cost, _ = windowed_dynamic_time_warping(fixation_XY1.astype(float), fixation_XY2.astype(float), abandon_above=abandon_above)
+		else:
+			cost, _ = dynamic_time_warping(fixation_XY1, fixation_XY2)
+		if cost == np.inf:
+			n_abandoned += 1
+			if n_abandoned == max_abandoned:
+				return np.inf # the median can only be infinite
 		results.append(cost)
-	return np.median(results)
+	median = np.median(results)
+	if abandon_above is not None and median > abandon_above:
+		return np.inf # abandoned trials may have made the median inaccurate
+	return median
 
-def make_algorithmic_distance_matrix(methods, filepath):
+def make_algorithmic_distance_matrix(methods, filepath, radius=None):
 	distances = []
 	for m1 in range(len(methods)):
 		print(methods[m1])
 		for m2 in range(m1+1, len(methods)):
 			print('-', methods[m2])
-			distances.append(algorithmic_output_distance(methods[m1], methods[m2]))
+			distances.append(algorithmic_output_distance(methods[m1], methods[m2], radius))
 	matrix = distance.squareform(distances, 'tomatrix')
 	with open(filepath, mode='wb') as file:
 		pickle.dump((methods, matrix), file)
 
+def find_near_duplicates(methods, threshold, radius=None):
+	'''
+	Find the pairs of methods (e.g. parameter variants) whose distance is
+	at most some threshold, so that near-duplicates can be dropped before
+	the distance matrix is made. Comparisons are abandoned as soon as the
+	distance must exceed the threshold. Returns (method1, method2,
+	distance) tuples.
+	'''
+	near_duplicates = []
+	for m1 in range(len(methods)):
+		for m2 in range(m1+1, len(methods)):
+			method_distance = algorithmic_output_distance(methods[m1], methods[m2], radius, abandon_above=threshold)
+			if method_distance <= threshold:
+				near_duplicates.append((methods[m1], methods[m2], method_distance))
+	return near_duplicates
+
+def approximation_error_report(methods, radius=1, n_samples=100, seed=117):
+	'''
+	Compare FastDTW at some radius against exact DTW on a random sample
+	of (method pair, trial) comparisons, reporting the relative error of
+	the approximate costs (which can only overestimate) and the speedup
+	over algorithms.dynamic_time_warping, the exact DTW that is used by
+	algorithmic_output_distance when no radius is given.
+	'''
+	from algorithms import dynamic_time_warping
+	random_state = np.random.RandomState(seed)
+	method_pairs = [(method1, method2) for i, method1 in enumerate(methods) for method2 in methods[i+1:]]
+	trial_ids = list(load_output(methods[0]))
+	errors, exact_time, approximate_time = [], 0.0, 0.0
+	for _ in range(n_samples):
+		method1, method2 = method_pairs[random_state.randint(len(method_pairs))]
+		trial_id = trial_ids[random_state.randint(len(trial_ids))]
+		fixation_XY1, fixation_XY2 = load_output(method1)[trial_id], load_output(method2)[trial_id]
+		start_time = perf_counter()
+		exact_cost, _ = dynamic_time_warping(fixation_XY1, fixation_XY2)
+		exact_time += perf_counter() - start_time
+		start_time = perf_counter()
+		approximate_cost, _ = fast_dynamic_time_warping(fixation_XY1, fixation_XY2, radius)
+		approximate_time += perf_counter() - start_time
+		errors.append((approximate_cost - exact_cost) / exact_cost if exact_cost > 0 else 0.0)
+	errors = np.array(errors)
+	return {'radius':radius, 'n_samples':n_samples, 'mean_relative_error':errors.mean(), 'p95_relative_error':np.percentile(errors, 95), 'max_relative_error':errors.max(), 'baseline':'algorithms.dynamic_time_warping', 'speedup':exact_time / approximate_time}
+
 def min_max_normalize(positions):
 	for i in range(positions.shape[1]):
 		positions[:, i] = (positions[:, i] - positions[:, i].min()) / (positions[:, i].max() - positions[:, i].min())
@@ -201,9 +377,9 @@ def plot_analyses(ahc_solution, mds_solution, filepath):
 
 	fig.tight_layout(pad=0.5, h_pad=1, w_pad=1)
 	fig.savefig(filepath, format='svg')
-	core.format_svg_labels(filepath, monospace=core.algorithms, arbitrary_replacements={'gold':'Gold standard', 'JC':'Jon', 'VP':'Vale'})
+	svg = core.format_svg_labels(filepath, monospace=core.algorithms, arbitrary_replacements={'gold':'Gold standard', 'JC':'Jon', 'VP':'Vale'})
 	if not filepath.endswith('.svg'):
-		core.convert_svg(filepath, filepath)
+		core.convert_svg(svg, filepath)
 
 
 if __name__ == '__main__':
@@ -211,6 +387,12 @@ if __name__ == '__main__':
 	# Measure pairwise distances between methods and pickle the distance matrix
 	# make_algorithmic_distance_matrix(core.good_algorithms+['gold'], core.DATA / 'algorithm_distances.pkl')
 
+	# For large corpora, check the error of approximate DTW on a sample and then
+	# measure the distances with FastDTW
+	# print(approximation_error_report(core.good_algorithms+['gold'], radius=1))
+	# print(find_near_duplicates(core.good_algorithms+['gold'], threshold=100, radius=1))
+	# make_algorithmic_distance_matrix(core.good_algorithms+['gold'], core.DATA / 'algorithm_distances.pkl', radius=1)
+
 	# Load the distance matrix created in the above step
 	with open(core.DATA / 'algorithm_distances.pkl', mode='rb') as file:
 		algorithm_distances = pickle.load(file)
@@ -3,12 +3,17 @@ Code for performing the fixation sequence simulations.
 '''
 
 from sys import stdout
+from multiprocessing import Pool
 import pickle
+import random
 import numpy as np
 import eyekit
 import lorem
 import algorithms
 import core
+import profiling
+from result_sink import ResultSink, conservative_interval_width
+from result_store import ResultStore
 
 
 class ReadingScenario:
@@ -26,9 +31,25 @@ class ReadingScenario:
 		self.max_characters_per_line = max_characters_per_line
 		self.character_spacing = character_spacing
 		self.line_spacing = line_spacing
+		# Random streams (all drawn from NumPy's global state by default)
+		self.random = np.random
+		self.regression_random = np.random
+		self.noise_random = np.random
+
+	def seed(self, seed):
+		'''
+		Gives the reading scenario its own seeded random streams: one for
+		landing positions and regression decisions, one for the content
+		of regressions, and one for noise. Two scenarios seeded with the
+		same value make the same underlying draws, whatever their
+		distortion and regression parameters.
+		'''
+		self.random = np.random.RandomState([seed, 0])
+		self.regression_random = np.random.RandomState([seed, 1])
+		self.noise_random = np.random.RandomState([seed, 2])
 
 	def _generate_passage(self):
-		n_lines = np.random.randint(self.min_lines, self.max_lines+1)
+		n_lines = self.random.randint(self.min_lines, self.max_lines+1)
 		lines = ['']
 		while len(lines) < n_lines:
 			for word in lorem.sentence().split():
@@ -46,9 +67,11 @@ class ReadingScenario:
 	def _generate_line_sequence(self, passage, line_i, partial_reading=False, inherited_line_y_for_shift=None):
 		x_margin, y_margin = passage.x_tl, passage.y_tl
 		max_line_width = passage.width
+		# Partial readings are regressions, so draw from the regression stream
+		landing_random = self.regression_random if partial_reading else self.random
 		if partial_reading:
-			start_point = np.random.randint(0, max_line_width//2) + x_margin
-			end_point = np.random.randint(max_line_width//2, max_line_width) + x_margin
+			start_point = landing_random.randint(0, max_line_width//2) + x_margin
+			end_point = landing_random.randint(max_line_width//2, max_line_width) + x_margin
 		else:
 			start_point = x_margin
 			end_point = max_line_width + x_margin
@@ -60,14 +83,14 @@ class ReadingScenario:
 				x_word_center = word.center[0]
 				if x_word_center < start_point or x_word_center > end_point:
 					continue
-				x_value = int(np.random.triangular(word[0].x, x_word_center, word[-1].x+1))
+				x_value = int(landing_random.triangular(word[0].x, x_word_center, word[-1].x+1))
 				line_X.append(x_value)
-				if word_i > 0 and np.random.random() < self.regression_within:
-					x_regression = int(np.random.triangular(x_margin, word[0].x+1, word[0].x+1))
+				if word_i > 0 and landing_random.random() < self.regression_within:
+					x_regression = int(self.regression_random.triangular(x_margin, word[0].x+1, word[0].x+1))
 					line_X.append(x_regression)
 		line_X = np.array(line_X, dtype=int) - x_margin
 		line_y = passage.midlines[line_i] - y_margin
-		line_Y = np.random.normal(line_y, self.noise, len(line_X))
+		line_Y = self.noise_random.normal(line_y, self.noise, len(line_X))
 		line_Y += line_X * self.slope
 		if inherited_line_y_for_shift:
 			line_Y += (inherited_line_y_for_shift - y_margin) * self.shift
@@ -83,9 +106,9 @@ class ReadingScenario:
 			X.extend(line_X)
 			Y.extend(line_Y)
 			intended_I.extend(line_I)
-			if line_i > 0 and np.random.random() < self.regression_between:
-				rand_prev_line = int(np.random.triangular(0, line_i, line_i))
-				rand_insert_point = np.random.randint(1, len(line_X))
+			if line_i > 0 and self.random.random() < self.regression_between:
+				rand_prev_line = int(self.regression_random.triangular(0, line_i, line_i))
+				rand_insert_point = self.regression_random.randint(1, len(line_X))
 				regression = self._generate_line_sequence(passage, rand_prev_line, partial_reading=True, inherited_line_y_for_shift=line_y)
 				for rx, ry, ri in zip(*regression):
 					X.insert(-rand_insert_point, rx)
@@ -107,43 +130,213 @@ class ReadingScenario:
 		return passage, fixation_XY, intended_I
 
 
-def simulate_factor(factor, n_gradations, n_sims):
+def interval_width(accuracies, confidence=0.95):
+	'''
+	Width of the confidence interval around the mean accuracy of each
+	algorithm, given a 2D array of accuracies with one row per algorithm
+	and one column per simulation (see conservative_interval_width).
+	'''
+	mean = accuracies.mean(axis=1)
+	sum_of_squares = ((accuracies - mean[:, np.newaxis])**2).sum(axis=1)
+	return conservative_interval_width(mean, sum_of_squares, accuracies.shape[1], confidence)
+
+def simulate_factor(factor, n_gradations, n_sims, profile_path=None, target_width=None, min_sims=10, confidence=0.95, crn_seed=None, sink=None):
 	'''
 	Performs some number of simulations for each gradation in the factor
 	space. A reading scenario is created for each factor value, and then,
 	for each simulation, a passage and fixation sequence are generated
 	and corrected by each algorithm. Results are returned as a 3D numpy
-	array.
+	array. If a profile path is given, a profiling record for every
+	algorithm call is appended to that JSON lines file.
+
+	If a target width is given, simulations at each gradation stop early
+	(after at least min_sims) once the confidence interval of every
+	algorithm's mean accuracy is narrower than the target width, with
+	n_sims acting as the maximum. Simulations that were not run are left
+	as NaN, so the number of simulations in each cell is given by
+	np.isfinite(results).sum(axis=2).
+
+	If a common-random-numbers seed is given, the same set of passages
+	and the same underlying random draws are used at every gradation,
+	so that differences between gradations reflect the factor value
+	rather than sampling noise.
+
+	If a ResultSink is given, results are streamed into it instead of
+	being stored in a dense array, and the sink is returned.
 	'''
-	results = np.zeros((len(core.algorithms), n_gradations, n_sims), dtype=float)
+	if profile_path:
+		profiler = profiling.Profiler(factor=factor)
+		profiler.enable()
+	if sink is None:
+		results = np.full((len(core.algorithms), n_gradations, n_sims), np.nan, dtype=float)
+	if crn_seed is not None:
+		np.random.seed(crn_seed)
+		random.seed(crn_seed) # lorem draws from Python's random module
+		passages = [ReadingScenario()._generate_passage() for _ in range(n_sims)]
 	_, (factor_min, factor_max) = core.factors[factor]
 	for gradation_i, factor_value in enumerate(np.linspace(factor_min, factor_max, n_gradations)):
 		print('%s = %f' % (factor, factor_value))
 		reading_scenario = ReadingScenario(**{factor:factor_value})
 		for sim_i in range(n_sims):
-			passage, fixation_XY, intended_I = reading_scenario.simulate()
+			profiling.label(factor_value=float(factor_value), sim=sim_i)
+			if crn_seed is None:
+				passage, fixation_XY, intended_I = reading_scenario.simulate()
+			else:
+				reading_scenario.seed(crn_seed + sim_i)
+				passage, fixation_XY, intended_I = reading_scenario.simulate(passages[sim_i])
 			for method_i, method in enumerate(core.algorithms):
 				corrected_I = algorithms.correct_drift(method, fixation_XY, passage, return_line_assignments=True)
 				matches = intended_I == corrected_I
-				results[method_i][gradation_i][sim_i] = sum(matches) / len(matches)
+				if sink is None:
+					results[method_i][gradation_i][sim_i] = sum(matches) / len(matches)
+				else:
+					sink.add(method_i, gradation_i, matches)
 			proportion_complete = (sim_i+1) / n_sims
 			stdout.write('\r')
 			stdout.write(f"[{'=' * int(100 * proportion_complete):{100}s}] {int(100 * proportion_complete)}%")
 			stdout.flush()
+			if target_width and sim_i+1 >= min_sims:
+				if sink is None:
+					widths = interval_width(results[:, gradation_i, :sim_i+1], confidence)
+				else:
+					widths = sink.interval_width(gradation_i, confidence)
+				if np.all(widths < target_width):
+					break
 		stdout.write('\n')
+		if target_width:
+			print('Stopped after %i simulations' % (sim_i+1))
+	if profile_path:
+		profiler.disable()
+		profiler.write(profile_path)
+		profiling.print_summary(profiling.summarize(profiler.records))
+	if sink is not None:
+		return sink
 	return results
 
 
+def latin_hypercube(n_cells, n_dimensions, seed):
+	'''
+	Latin hypercube sample in the unit cube: each dimension is divided
+	into n_cells strata, and each stratum is sampled exactly once.
+	'''
+	random_state = np.random.RandomState(seed)
+	design = np.zeros((n_cells, n_dimensions), dtype=float)
+	for dimension in range(n_dimensions):
+		strata = random_state.permutation(n_cells)
+		design[:, dimension] = (strata + random_state.random_sample(n_cells)) / n_cells
+	return design
+
+def sobol_sequence(n_cells, n_dimensions, seed):
+	from scipy.stats import qmc # requires scipy >= 1.7
+	return qmc.Sobol(n_dimensions, scramble=True, seed=seed).random(n_cells)
+
+designs = {'lhs':latin_hypercube, 'sobol':sobol_sequence}
+
+def simulate_cell(cell):
+	'''
+	Runs the simulations for a single cell of a joint design, where all
+	factors are set at once. Returns the accuracy of each algorithm on
+	each simulation as a 2D array.
+	'''
+	cell_i, factor_values, n_sims, seed = cell
+	cell_seed = seed * 100003 + cell_i
+	# The passages and fixations are drawn from the scenario's own random
+	# streams and from Python's random module (lorem); NumPy's global
+	# state is only used by the KMeans fits in cluster and split, which
+	# are seeded here so that the cell is reproducible
+	np.random.seed(cell_seed % 2**32)
+	random.seed(cell_seed)
+	reading_scenario = ReadingScenario(**factor_values)
+	reading_scenario.seed(cell_seed)
+	results = np.zeros((len(core.algorithms), n_sims), dtype=float)
+	for sim_i in range(n_sims):
+		passage, fixation_XY, intended_I = reading_scenario.simulate()
+		for method_i, method in enumerate(core.algorithms):
+			corrected_I = algorithms.correct_drift(method, fixation_XY, passage, return_line_assignments=True)
+			matches = intended_I == corrected_I
+			results[method_i][sim_i] = sum(matches) / len(matches)
+	return results
+
+def simulate_joint(n_cells, n_sims, design='lhs', n_processes=None, seed=117):
+	'''
+	Samples the joint space of all the factors using a space-filling
+	design (Latin hypercube or Sobol) and performs some number of
+	simulations in each cell, spreading the cells over a pool of
+	processes. Returns the design (the factor values in each cell) as a
+	2D array and the results as a 3D array (algorithms, cells, sims).
+	'''
+	factors = list(core.factors)
+	unit_design = designs[design](n_cells, len(factors), seed)
+	lower_bounds = np.array([core.factors[factor][1][0] for factor in factors])
+	upper_bounds = np.array([core.factors[factor][1][1] for factor in factors])
+	factor_design = lower_bounds + unit_design * (upper_bounds - lower_bounds)
+	cells = [(cell_i, dict(zip(factors, factor_values)), n_sims, seed) for cell_i, factor_values in enumerate(factor_design)]
+	results = np.zeros((len(core.algorithms), n_cells, n_sims), dtype=float)
+	with Pool(n_processes) as pool:
+		for cell_i, cell_results in enumerate(pool.imap(simulate_cell, cells)):
+			results[:, cell_i, :] = cell_results
+			print('Cell %i of %i complete' % (cell_i+1, n_cells))
+	return factor_design, results
+
+def save_joint(file_path, factor_design, results, **metadata):
+	'''
+	Stores a joint simulation as a compressed .npz file, indexed by the
+	factor values of each cell.
+	'''
+	np.savez_compressed(file_path, factors=np.array(list(core.factors)), algorithms=np.array(core.algorithms), design=factor_design, results=results.astype(np.float32), metadata=np.array(repr(metadata)))
+
+def query_joint(file_path, **factor_ranges):
+	'''
+	Loads the cells of a joint simulation whose factor values fall
+	within the given ranges, e.g. query_joint(path, noise=(0, 10),
+	slope=(-0.05, 0.05)). Returns the factor names, algorithm names,
+	design, and results for the matching cells.
+	'''
+	with np.load(file_path) as data:
+		factors = list(data['factors'])
+		design, results = data['design'], data['results']
+		algorithm_names = list(data['algorithms'])
+	selected = np.ones(len(design), dtype=bool)
+	for factor, (min_value, max_value) in factor_ranges.items():
+		factor_values = design[:, factors.index(factor)]
+		selected &= (factor_values >= min_value) & (factor_values <= max_value)
+	return factors, algorithm_names, design[selected], results[:, selected]
+
+
 if __name__ == '__main__':
 
 	import argparse
 	parser = argparse.ArgumentParser()
-	parser.add_argument('factor', action='store', type=str, help='factor to simulate')
+	parser.add_argument('factor', action='store', type=str, help='factor to simulate (or "joint" to sample all factors at once)')
 	parser.add_argument('output_dir', action='store', type=str, help='directory to write results to')
 	parser.add_argument('--n_gradations', action='store', type=int, default=50, help='number of gradations in factor')
 	parser.add_argument('--n_sims', action='store', type=int, default=100, help='number of simulations per gradation')
+	parser.add_argument('--profile', action='store', type=str, default=None, help='JSON lines file to write profiling records to')
+	parser.add_argument('--target_width', action='store', type=float, default=None, help='stop a gradation once every confidence interval is narrower than this (n_sims becomes the maximum)')
+	parser.add_argument('--min_sims', action='store', type=int, default=10, help='minimum number of simulations per gradation when stopping adaptively')
+	parser.add_argument('--crn_seed', action='store', type=int, default=None, help='reuse the same passages and random draws across gradations (common random numbers)')
+	parser.add_argument('--n_cells', action='store', type=int, default=200, help='number of cells in the joint design')
+	parser.add_argument('--design', action='store', type=str, default='lhs', help='space-filling design for the joint simulation (lhs or sobol)')
+	parser.add_argument('--n_processes', action='store', type=int, default=None, help='number of processes for the joint simulation')
+	parser.add_argument('--seed', action='store', type=int, default=117, help='random seed for the joint simulation')
+	parser.add_argument('--stream', action='store_true', help='stream summary statistics to a .npz file instead of pickling all results')
+	parser.add_argument('--log_errors', action='store_true', help='when streaming, also log the per-fixation error masks')
+	parser.add_argument('--format', action='store', type=str, default='pkl', help='output format for the results (pkl or res)')
 	args = parser.parse_args()
 
-	results = simulate_factor(args.factor, args.n_gradations, args.n_sims)
-	with open('%s/%s.pkl' % (args.output_dir, args.factor), mode='wb') as file:
-		pickle.dump(results, file)
+	if args.factor == 'joint':
+		factor_design, results = simulate_joint(args.n_cells, args.n_sims, args.design, args.n_processes, args.seed)
+		save_joint('%s/joint.npz' % args.output_dir, factor_design, results, design=args.design, seed=args.seed, n_sims=args.n_sims)
+	elif args.stream:
+		sink = ResultSink(len(core.algorithms), args.n_gradations, args.log_errors)
+		simulate_factor(args.factor, args.n_gradations, args.n_sims, args.profile, args.target_width, args.min_sims, crn_seed=args.crn_seed, sink=sink)
+		sink.save('%s/%s.npz' % (args.output_dir, args.factor))
+	else:
+		results = simulate_factor(args.factor, args.n_gradations, args.n_sims, args.profile, args.target_width, args.min_sims, crn_seed=args.crn_seed)
+		if args.format == 'res':
+			_, (factor_min, factor_max) = core.factors[args.factor]
+			factor_values = np.linspace(factor_min, factor_max, args.n_gradations)
+			ResultStore.write('%s/%s.res' % (args.output_dir, args.factor), results, factor_values, factor=args.factor, seed=args.crn_seed, params=vars(args))
+		else:
+			with open('%s/%s.pkl' % (args.output_dir, args.factor), mode='wb') as file:
+				pickle.dump(results, file)
@@ -3,16 +3,36 @@ Code for plotting the simulation results.
 '''
 
 import pickle
+from functools import lru_cache
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.transforms as transforms
 from matplotlib import gridspec
 import core
+from result_store import ResultStore
 
 plt.rcParams['svg.fonttype'] = 'none' # don't convert fonts to curves in SVGs
 plt.rcParams.update({'font.size': 7})
 
 
+@lru_cache(maxsize=None)
+def load_pickled_results(factor):
+	with open(core.SIMULATIONS / f'{factor}.pkl', mode='rb') as file:
+		return pickle.load(file)
+
+def load_results(factor, algorithm):
+	'''
+	Load the simulation results of one algorithm for some factor. If the
+	results have been migrated to a result store, only the bytes for that
+	algorithm are read; otherwise, the whole pickle is loaded (once).
+	'''
+	store_path = core.SIMULATIONS / f'{factor}.res'
+	if store_path.exists():
+		with ResultStore(store_path) as store:
+			return store.select(algorithm=algorithm)
+	return load_pickled_results(factor)[core.algorithms.index(algorithm)]
+
+
 def plot_results(filepath, layout, n_rows=2, figsize=None, stagger=0):
 	filepath = str(filepath)
 	n_cols = len(layout) // n_rows
@@ -30,13 +50,11 @@ def plot_results(filepath, layout, n_rows=2, figsize=None, stagger=0):
 			for line in legend.get_lines():
 				line.set_linewidth(2.5)
 			continue
-		with open(core.SIMULATIONS / f'{factor}.pkl', mode='rb') as file:
-			results = pickle.load(file)
-		results *= 100
 		factor_label, (factor_min_val, factor_max_val) = core.factors[factor]
-		factor_space = np.linspace(factor_min_val, factor_max_val, len(results[0]))
 		for method_i, method in enumerate(core.algorithms):
-			means = results[method_i, :].mean(axis=1)
+			results = load_results(factor, method) * 100
+			factor_space = np.linspace(factor_min_val, factor_max_val, len(results))
+			means = np.nanmean(results, axis=1)
 			staggering = (method_i - (len(core.algorithms)-1) / 2) * stagger
 			staggered_means = means - staggering
 			line, = axes[r][c].plot(factor_space, staggered_means, color=core.colors[method], label=method, linewidth=1)
@@ -57,9 +75,9 @@ def plot_results(filepath, layout, n_rows=2, figsize=None, stagger=0):
 		axes[r][c].axis('off')
 	fig.tight_layout(pad=0.5, h_pad=1, w_pad=1)
 	fig.savefig(filepath, format='svg')
-	core.format_svg_labels(filepath, core.algorithms)
+	svg = core.format_svg_labels(filepath, core.algorithms)
 	if not filepath.endswith('.svg'):
-		core.convert_svg(filepath, filepath)
+		core.convert_svg(svg, filepath)
 
 
 def plot_invariance(filepath, show_percentages=False):
@@ -67,11 +85,10 @@ def plot_invariance(filepath, show_percentages=False):
 	accuracy = np.zeros((len(core.algorithms), len(core.factors)), dtype=float)
 	invariance = np.zeros((len(core.algorithms), len(core.factors)), dtype=bool)
 	for f, factor in enumerate(core.factors):
-		with open(core.SIMULATIONS / f'{factor}.pkl', mode='rb') as file:
-			results = pickle.load(file)
 		for a, algorithm in enumerate(core.algorithms):
-			accuracy[a, f] = results[a].mean() * 100
-			if np.all(results[a] == 1.0):
+			results = load_results(factor, algorithm)
+			accuracy[a, f] = np.nanmean(results) * 100
+			if np.all(results[np.isfinite(results)] == 1.0):
 				invariance[a, f] = True
 	fig = plt.figure(figsize=(3.3, 2))
 	gs = gridspec.GridSpec(1, 2, width_ratios=[20, 1])
@@ -92,9 +109,9 @@ def plot_invariance(filepath, show_percentages=False):
 	legend.set_ylabel('Mean accuracy (%)', labelpad=-38)
 	fig.tight_layout(pad=0.5, h_pad=1, w_pad=1)
 	fig.savefig(filepath, format='svg')
-	core.format_svg_labels(filepath, core.algorithms)
+	svg = core.format_svg_labels(filepath, core.algorithms)
 	if not filepath.endswith('.svg'):
-		core.convert_svg(filepath, filepath)
+		core.convert_svg(svg, filepath)
 
 
 if __name__ == '__main__':
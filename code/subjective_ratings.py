@@ -10,41 +10,44 @@ IDs back to the trial/algorithm.
 import eyekit
 import core
 import random
+import rendering
 
 passages = eyekit.io.read(core.DATA / 'passages.json')
 datasets = {dataset : eyekit.io.read(core.FIXATIONS / f'{dataset}.json') for dataset in ['sample', 'gold']+core.algorithms}
 
-def generate_rating_set(rater_id):
+def render_rating_image(job):
+	trial_id, algorithm, output_path = job
+	trial = datasets['sample'][trial_id]
+	passage = passages[trial['passage_id']]
+
+	original_image = rendering.text_block_image(passage)
+	original_image.draw_fixation_sequence(trial['fixations'])
+
+	correction_image = rendering.text_block_image(passage)
+	correction_image.draw_sequence_comparison(datasets['gold'][trial_id]['fixations'], datasets[algorithm][trial_id]['fixations'])
+
+	fig = eyekit.vis.Figure(1, 2)
+	fig.add_image(original_image)
+	fig.add_image(correction_image)
+	fig.set_crop_margin(2)
+	fig.set_enumeration(False)
+	fig.set_padding(5, 5, 10)
+	fig.save(output_path)
+
+def generate_rating_set(rater_id, n_processes=None):
 
 	random_ids = [str(i).zfill(3) for i in range(1, 481)]
 	random.shuffle(random_ids)
 	id_trial_mapping = []
+	jobs = []
 
 	for trial_id, trial in datasets['sample'].items():
-
-		orig_fixation_sequence = trial['fixations']
-		gold_fixation_sequence = datasets['gold'][trial_id]['fixations']
-
-		original_image = eyekit.vis.Image(1920, 1080)
-		original_image.draw_text_block(passages[trial['passage_id']], color='gray')
-		original_image.draw_fixation_sequence(orig_fixation_sequence)
-
 		for algorithm in core.algorithms:
-
 			random_id = random_ids.pop()
 			id_trial_mapping.append(f'{random_id}\t{trial_id}\t{algorithm}')
+			jobs.append((trial_id, algorithm, core.VISUALS / 'rating_images' / rater_id / f'{random_id}.pdf'))
 
-			correction_image = eyekit.vis.Image(1920, 1080)
-			correction_image.draw_text_block(passages[trial['passage_id']], color='gray')
-			correction_image.draw_sequence_comparison(gold_fixation_sequence, datasets[algorithm][trial_id]['fixations'])
-
-			fig = eyekit.vis.Figure(1, 2)
-			fig.add_image(original_image)
-			fig.add_image(correction_image)
-			fig.set_crop_margin(2)
-			fig.set_enumeration(False)
-			fig.set_padding(5, 5, 10)
-			fig.save(core.VISUALS / 'rating_images' / rater_id / f'{random_id}.pdf')
+	rendering.render_in_parallel(render_rating_image, jobs, n_processes)
 
 	id_trial_mapping.sort()
 
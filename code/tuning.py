@@ -0,0 +1,300 @@
+'''
+Code for tuning the parameters of the algorithms against the gold standard
+manual correction or against simulated reading scenarios. Candidate
+parameter settings come from a grid or from a Bayesian search (a Gaussian
+process with expected improvement), and each batch of candidates is
+scored on every trial in parallel, one trial per worker.
+
+Within a trial, work is shared between candidates where the structure of
+the algorithm allows it. For a given y_thresh, chain's boundaries at some
+x_thresh are a subset of its boundaries at any smaller x_thresh, so the
+candidates are visited in order of decreasing x_thresh and each new
+boundary just splits the chain that contains it, with the chain means
+read off prefix sums of the fixation y-values. compare's line
+segmentation depends only on x_thresh, and the DTW cost of a gaze line
+against a text line is the same whichever candidate needs it, so those
+costs are memoized per trial. Other algorithms are rerun for each
+candidate.
+
+To tune chain against the gold standard:
+
+	python tuning.py chain --data gold --search grid
+'''
+
+from multiprocessing import Pool
+import bisect
+import itertools
+import json
+import random
+import numpy as np
+import algorithms
+import core
+import simulation
+
+
+def integer(value):
+	return int(round(value))
+
+def symmetric(value):
+	return (-value, value)
+
+# The space searched for each method: parameter -> (low, high, decoder),
+# where the decoder maps a value in [low, high] to the parameter value
+search_spaces = {
+	'chain': {'x_thresh':(16, 512, integer), 'y_thresh':(4, 128, integer)},
+	'compare': {'x_thresh':(64, 1024, integer), 'n_nearest_lines':(1, 5, integer)},
+	'merge': {'y_thresh':(4, 128, integer), 'g_thresh':(0.01, 0.5, float), 'e_thresh':(5, 100, float)},
+	'regress': {'k_bounds':(0.01, 0.5, symmetric), 'o_bounds':(10, 200, symmetric), 's_bounds':(2, 50, lambda value: (1, value))},
+	'stretch': {'scale_bounds':(0.01, 0.5, lambda value: (1 - value, 1 + value)), 'offset_bounds':(10, 200, symmetric)},
+}
+
+
+def make_trial(fixation_XY, passage, true_I, mask=None):
+	'''
+	Pack a trial into arrays: fixations, line positions, word centers,
+	the correct line of each fixation, and which fixations to score.
+	'''
+	if mask is None:
+		mask = np.ones(len(true_I), dtype=bool)
+	return (np.array(fixation_XY, dtype=int), np.array(passage.midlines, dtype=int), np.array(passage.word_centers(), dtype=int), np.array(true_I, dtype=int), np.array(mask, dtype=bool))
+
+def gold_trials():
+	'''
+	The sample trials scored against the gold standard. Fixations that
+	were discarded in the gold standard are not scored.
+	'''
+	import eyekit
+	passages = eyekit.io.read(core.DATA / 'passages.json')
+	sample_data = eyekit.io.read(core.FIXATIONS / 'sample.json')
+	gold_data = eyekit.io.read(core.FIXATIONS / 'gold.json')
+	trials = []
+	for trial_id, trial in sample_data.items():
+		gold_fixations = gold_data[trial_id]['fixations']
+		true_I = [core.y_to_line_mapping.get(fixation.y, 0) - 1 for fixation in gold_fixations]
+		mask = [not fixation.discarded for fixation in gold_fixations]
+		trials.append(make_trial([fixation.xy for fixation in trial['fixations']], passages[trial['passage_id']], true_I, mask))
+	return trials
+
+def simulated_trials(n_trials, seed=117, **scenario_params):
+	'''
+	Trials generated by a reading scenario, scored against the intended
+	lines.
+	'''
+	np.random.seed(seed)
+	random.seed(seed) # lorem draws from Python's random module
+	reading_scenario = simulation.ReadingScenario(**scenario_params)
+	trials = []
+	for _ in range(n_trials):
+		passage, fixation_XY, intended_I = reading_scenario.simulate()
+		trials.append(make_trial(fixation_XY, passage, intended_I))
+	return trials
+
+
+class ChainSweep:
+
+	def __init__(self, fixation_XY, line_Y, word_XY):
+		self.n = len(fixation_XY)
+		self.dist_X = abs(np.diff(fixation_XY[:, 0]))
+		self.dist_Y = abs(np.diff(fixation_XY[:, 1]))
+		self.cumulative_Y = np.concatenate([[0], np.cumsum(fixation_XY[:, 1])])
+		self.line_Y = line_Y
+
+	def __call__(self, x_thresh=192, y_thresh=32):
+		starts = np.concatenate([[0], np.where(np.logical_or(self.dist_X > x_thresh, self.dist_Y > y_thresh))[0] + 1])
+		ends = np.append(starts[1:], self.n)
+		mean_Y = (self.cumulative_Y[ends] - self.cumulative_Y[starts]) / (ends - starts)
+		line_I = np.argmin(abs(self.line_Y[np.newaxis, :] - mean_Y[:, np.newaxis]), axis=1)
+		return np.repeat(line_I, ends - starts)
+
+	def _split(self, line_I, boundaries, boundary):
+		'''
+		Add a boundary, reassigning the two halves of the chain it splits.
+		'''
+		chain_i = bisect.bisect(boundaries, boundary)
+		start, end = boundaries[chain_i-1], boundaries[chain_i]
+		boundaries.insert(chain_i, boundary)
+		for start, end in [(start, boundary), (boundary, end)]:
+			mean_y = (self.cumulative_Y[end] - self.cumulative_Y[start]) / (end - start)
+			line_I[start:end] = np.argmin(abs(self.line_Y - mean_y))
+
+	def assignments(self, candidates):
+		'''
+		Line assignments for each candidate. The candidates are grouped by
+		y_thresh and visited in order of decreasing x_thresh, so that each
+		gap in x is added as a boundary once per group.
+		'''
+		defaults = algorithms.registry['chain']['defaults']
+		groups, results = {}, [None] * len(candidates)
+		for candidate_i, params in enumerate(candidates):
+			params = {**defaults, **params}
+			groups.setdefault(params['y_thresh'], []).append((params['x_thresh'], candidate_i))
+		for y_thresh, group in groups.items():
+			is_boundary = self.dist_Y > y_thresh
+			line_I = self(np.inf, y_thresh)
+			boundaries = [0] + list(np.where(is_boundary)[0] + 1) + [self.n]
+			gap_order = [gap_i for gap_i in np.argsort(-self.dist_X, kind='stable') if not is_boundary[gap_i]]
+			next_gap = 0
+			for x_thresh, candidate_i in sorted(group, reverse=True):
+				while next_gap < len(gap_order) and self.dist_X[gap_order[next_gap]] > x_thresh:
+					self._split(line_I, boundaries, gap_order[next_gap] + 1)
+					next_gap += 1
+				results[candidate_i] = line_I.copy()
+		return results
+
+
+class CompareSweep:
+
+	def __init__(self, fixation_XY, line_Y, word_XY):
+		self.fixation_XY = fixation_XY
+		self.diff_X = np.diff(fixation_XY[:, 0])
+		self.line_Y = line_Y
+		self.text_lines = [word_XY[word_XY[:, 1] == y] for y in line_Y]
+		self.costs = {}
+
+	def _cost(self, start, end, line_i):
+		if (start, end, line_i) not in self.costs:
+			gaze_line = self.fixation_XY[start:end]
+			self.costs[start, end, line_i], _ = algorithms.dynamic_time_warping(gaze_line[:, 0:1], self.text_lines[line_i][:, 0:1])
+		return self.costs[start, end, line_i]
+
+	def __call__(self, x_thresh=512, n_nearest_lines=3):
+		n = len(self.fixation_XY)
+		end_line_indices = list(np.where(self.diff_X < -x_thresh)[0] + 1)
+		end_line_indices.append(n)
+		line_assignments = np.zeros(n, dtype=int)
+		start_of_line = 0
+		for end_of_line in end_line_indices:
+			mean_y = np.mean(self.fixation_XY[start_of_line:end_of_line, 1])
+			nearest_line_I = np.argsort(abs(self.line_Y - mean_y))[:n_nearest_lines]
+			line_costs = [self._cost(start_of_line, end_of_line, line_i) for line_i in nearest_line_I]
+			line_assignments[start_of_line:end_of_line] = nearest_line_I[np.argmin(line_costs)]
+			start_of_line = end_of_line
+		return line_assignments
+
+	def assignments(self, candidates):
+		return [self(**params) for params in candidates]
+
+sweeps = {'chain':ChainSweep, 'compare':CompareSweep}
+
+
+def line_assignments(method, fixation_XY, line_Y, word_XY, params):
+	'''
+	Run a method and map each corrected fixation to its nearest line.
+	'''
+	args = [fixation_XY.copy(), line_Y]
+	if 'word_XY' in algorithms.registry[method]['inputs']:
+		args.append(word_XY)
+	corrected_XY = algorithms.registry[method]['function'](*args, **params)
+	return np.argmin(abs(line_Y[np.newaxis, :] - corrected_XY[:, 1:2]), axis=1)
+
+def init_worker(trials):
+	global worker_trials
+	worker_trials = trials
+
+def score_trial(method, trial_i, candidates):
+	'''
+	Accuracy of every candidate parameter setting on one trial.
+	'''
+	fixation_XY, line_Y, word_XY, true_I, mask = worker_trials[trial_i]
+	if method in sweeps:
+		assignments = sweeps[method](fixation_XY, line_Y, word_XY).assignments(candidates)
+	else:
+		assignments = (line_assignments(method, fixation_XY, line_Y, word_XY, params) for params in candidates)
+	return [np.mean((line_I == true_I)[mask]) for line_I in assignments]
+
+def evaluate(method, candidates, n_trials, pool):
+	'''
+	Mean accuracy of each candidate across the trials held by the pool.
+	'''
+	scores = pool.starmap(score_trial, [(method, trial_i, candidates) for trial_i in range(n_trials)])
+	return np.mean(scores, axis=0)
+
+
+def decode(method, point, space=None):
+	'''
+	Map a point in the unit cube to a parameter setting.
+	'''
+	if space is None:
+		space = search_spaces[method]
+	return {name:decoder(low + float(value) * (high - low)) for value, (name, (low, high, decoder)) in zip(point, space.items())}
+
+def grid_search(method, trials, n_points=5, space=None, n_processes=None):
+	'''
+	Score an evenly spaced grid of n_points per parameter. Returns a list
+	of (accuracy, params), best first.
+	'''
+	if space is None:
+		space = search_spaces[method]
+	candidates = []
+	for point in itertools.product(np.linspace(0, 1, n_points), repeat=len(space)):
+		params = decode(method, point, space)
+		if params not in candidates:
+			candidates.append(params)
+	with Pool(n_processes, initializer=init_worker, initargs=(trials,)) as pool:
+		accuracies = evaluate(method, candidates, len(trials), pool)
+	return sorted(zip(accuracies, candidates), key=lambda result: result[0], reverse=True)
+
+def bayesian_search(method, trials, n_iterations=10, batch_size=8, n_initial=16, space=None, n_processes=None, seed=117):
+	'''
+	Bayesian search over the unit cube: starting from a Latin hypercube
+	of n_initial candidates, a Gaussian process is fitted to the scores
+	so far, and the batch_size candidates with the greatest expected
+	improvement are scored next. Returns a list of (accuracy, params),
+	best first.
+	'''
+	from sklearn.gaussian_process import GaussianProcessRegressor
+	from sklearn.gaussian_process.kernels import Matern
+	from scipy.stats import norm
+	if space is None:
+		space = search_spaces[method]
+	random_state = np.random.RandomState(seed)
+	points = simulation.latin_hypercube(n_initial, len(space), seed)
+	with Pool(n_processes, initializer=init_worker, initargs=(trials,)) as pool:
+		accuracies = evaluate(method, [decode(method, point, space) for point in points], len(trials), pool)
+		for iteration in range(n_iterations):
+			gaussian_process = GaussianProcessRegressor(kernel=Matern(nu=2.5), normalize_y=True, random_state=random_state)
+			gaussian_process.fit(points, accuracies)
+			proposals = random_state.random_sample((1000, len(space)))
+			mean, std = gaussian_process.predict(proposals, return_std=True)
+			improvement = mean - accuracies.max()
+			z = improvement / np.maximum(std, 1e-9)
+			expected_improvement = improvement * norm.cdf(z) + std * norm.pdf(z)
+			batch = proposals[np.argsort(expected_improvement)[::-1][:batch_size]]
+			points = np.concatenate([points, batch])
+			accuracies = np.concatenate([accuracies, evaluate(method, [decode(method, point, space) for point in batch], len(trials), pool)])
+			print('Iteration %i: best accuracy %.4f' % (iteration + 1, accuracies.max()))
+	return sorted(zip(accuracies, [decode(method, point, space) for point in points]), key=lambda result: result[0], reverse=True)
+
+
+if __name__ == '__main__':
+
+	import argparse
+	parser = argparse.ArgumentParser()
+	parser.add_argument('method', action='store', type=str, choices=list(search_spaces), help='algorithm to tune')
+	parser.add_argument('--data', action='store', type=str, default='gold', choices=['gold', 'simulated'], help='score against the gold standard or simulated trials')
+	parser.add_argument('--search', action='store', type=str, default='grid', choices=['grid', 'bayes'], help='grid or Bayesian search')
+	parser.add_argument('--n_points', action='store', type=int, default=5, help='grid points per parameter')
+	parser.add_argument('--n_iterations', action='store', type=int, default=10, help='Bayesian search iterations')
+	parser.add_argument('--batch_size', action='store', type=int, default=8, help='candidates per Bayesian search iteration')
+	parser.add_argument('--n_trials', action='store', type=int, default=100, help='number of simulated trials')
+	parser.add_argument('--n_processes', action='store', type=int, default=None, help='number of worker processes')
+	parser.add_argument('--seed', action='store', type=int, default=117, help='random seed')
+	parser.add_argument('--output', action='store', type=str, default=None, help='JSON file to write all scored candidates to')
+	args = parser.parse_args()
+
+	if args.data == 'gold':
+		trials = gold_trials()
+	else:
+		trials = simulated_trials(args.n_trials, args.seed)
+
+	if args.search == 'grid':
+		results = grid_search(args.method, trials, args.n_points, n_processes=args.n_processes)
+	else:
+		results = bayesian_search(args.method, trials, args.n_iterations, args.batch_size, n_processes=args.n_processes, seed=args.seed)
+
+	for accuracy, params in results[:10]:
+		print('%.4f' % accuracy, params)
+
+	if args.output:
+		with open(args.output, mode='w', encoding='utf-8') as file:
+			json.dump([{'accuracy':float(accuracy), 'params':params} for accuracy, params in results], file, indent='\t')